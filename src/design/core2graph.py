@@ -53,9 +53,10 @@ def load_core(file, *libs):
 
         src_name = src[0]
         dst_name = dst[0]
-        src_port = PORT_TRANSLATION[modules[src_name]['type']][','.join(src[1:])]
-        dst_port = PORT_TRANSLATION[modules[dst_name]['type']][','.join(dst[1:])]
-        width = 16
+        # 1-bit nets are routed on their own layer
+        width = 1 if 'bit' in src or 'bit' in dst else 16
+        src_port = _translate_port(modules[src_name]['type'], src[1:], width)
+        dst_port = _translate_port(modules[dst_name]['type'], dst[1:], width)
 
         net = (src_name, src_port, dst_name, dst_port, width)
         nets.add(net)
@@ -71,17 +72,28 @@ PORT_TRANSLATION = {
         'data,in,1' : 'b',
         'data,out'  : 'out',
         'bit,in,0'  : 'd',
+        'bit,out'   : 'out',
     },
     'Const' : {
         'out' : 'out',
     },
     'IO' : {
-        'in'  : 'a',
-        'out' : 'out',
+        'in'      : 'a',
+        'out'     : 'out',
+        'bit,in'  : 'd',
+        'bit,out' : 'out',
     },
 }
 
 
+def _translate_port(type_, path, width):
+    port = ','.join(path)
+    # IO ports do not name their width
+    if type_ == 'IO' and width == 1:
+        port = 'bit,' + port
+    return PORT_TRANSLATION[type_][port]
+
+
 
 #def load_core(file):
 #    mods = SortedDict()
@@ -31,3 +31,30 @@ class Design(NamedIDObject):
         return self._nets
 
 
+
+
+def merge_designs(designs, prefixes=None):
+    '''
+        Merges independent designs into one, module names are prefixed
+        (by default with d<index>_) to keep them apart
+        Returns the merged design and for each design the set of its
+        modules in the merged design
+    '''
+    designs = tuple(designs)
+    if prefixes is None:
+        prefixes = ['d{}_'.format(idx) for idx in range(len(designs))]
+    if len(set(prefixes)) != len(designs):
+        raise ValueError('Expected {} distinct prefixes'.format(len(designs)))
+
+    modules = dict()
+    nets = []
+    for d, prefix in zip(designs, prefixes):
+        for mod in d.modules:
+            modules[prefix + mod.name] = {'type' : mod.type_, 'conf' : mod.config}
+        for net in d.nets:
+            nets.append((prefix + net.src.name, net.src_port, prefix + net.dst.name, net.dst_port, net.width))
+
+    merged = Design(modules, nets, '+'.join(d.name for d in designs))
+    by_name = {mod.name : mod for mod in merged.modules}
+    parts = [{by_name[prefix + mod.name] for mod in d.modules} for d, prefix in zip(designs, prefixes)]
+    return merged, parts
@@ -1,3 +1,4 @@
+from collections import defaultdict
 import lxml.etree as ET
 from util import NamedIDObject
 from .fabricfuns import Side, mapSide, parse_name
@@ -71,6 +72,28 @@ class Track(NamedIDObject):
     def parent(self):
         return self._parent
 
+    def expand(self):
+        ''' the tracks of the fabric this track stands for '''
+        return (self,)
+
+
+class ChainTrack(Track):
+    '''
+       A path of tracks through ports which can only be used on that path
+       (see contract_chains).  Behaves like a single track from the src of
+       the first track to the dst of the last one.
+    '''
+    def __init__(self, tracks):
+        tracks = tuple(t for track in tracks for t in track.expand())
+        first = tracks[0]
+        last = tracks[-1]
+        super().__init__(first.src, last.dst, first.width,
+                         (first.track_names[0], last.track_names[1]), first.parent)
+        self._tracks = tracks
+
+    def expand(self):
+        return self._tracks
+
 #    def __repr__(self):
 #        return '{} --> {}'.format(self._names[0], self._names[1])
 
@@ -103,6 +126,8 @@ class Fabric:
     def __init__(self, parsed_params):
         self._rows = parsed_params['rows']
         self._cols = parsed_params['cols']
+        self._sites = parsed_params['sites']
+        self._num_tracks = {(x, y, int(bus_width)) : n for (x, y, bus_width), n in parsed_params['num_tracks'].items()}
         self._layers = dict()
         for bus_width in parsed_params['bus_widths']:
             fl = FabricLayer(parsed_params['sources' + bus_width],
@@ -119,6 +144,16 @@ class Fabric:
     def cols(self):
         return self._cols
 
+    @property
+    def sites(self):
+        ''' dict of (x, y) -> kind of tile at that site ('PE', 'Mem' or None)'''
+        return self._sites
+
+    @property
+    def num_tracks(self):
+        ''' dict of (x, y, bus_width) -> number of tracks at that site'''
+        return self._num_tracks
+
     @property
     def height(self):
         ''' alias for rows'''
@@ -132,6 +167,64 @@ class Fabric:
     def __getitem__(self, bus_width):
         return self._layers[bus_width]
 
+    def contract_chains(self):
+        ''' replaces every layer with its contracted version (see contract_chains) '''
+        for bus_width, layer in self._layers.items():
+            self._layers[bus_width] = contract_chains(layer)
+
+
+def contract_chains(layer):
+    '''
+       Reduces the routing graph of a layer.  Tracks into or out of ports
+       that can never be on a route (other than sources and sinks) are
+       dropped, and ports with a single input or a single output track
+       (e.g. after a feedthrough) are contracted into ChainTracks.
+       Returns a new FabricLayer, expand the tracks of a route to get back
+       to tracks of the fabric.
+    '''
+    endpoints = set(layer.sources.values()) | set(layer.sinks.values())
+    ins = defaultdict(set)
+    outs = defaultdict(set)
+    for track in layer.tracks:
+        ins[track.dst].add(track)
+        outs[track.src].add(track)
+
+    def remove(track):
+        ins[track.dst].discard(track)
+        outs[track.src].discard(track)
+
+    def add(track):
+        # a loop never helps a route
+        if track.src != track.dst:
+            ins[track.dst].add(track)
+            outs[track.src].add(track)
+
+    order = list(layer.tracks)
+    work = set(ins) | set(outs)
+    while work:
+        port = work.pop()
+        if port in endpoints:
+            continue
+        t_ins = list(ins[port])
+        t_outs = list(outs[port])
+        if not t_ins and not t_outs:
+            continue
+        if t_ins and t_outs and len(t_ins) > 1 and len(t_outs) > 1:
+            continue
+
+        for track in t_ins + t_outs:
+            remove(track)
+        # nothing is added for a dead end
+        for t1 in t_ins:
+            for t2 in t_outs:
+                chain = ChainTrack((t1, t2))
+                add(chain)
+                order.append(chain)
+        work |= {track.src for track in t_ins} | {track.dst for track in t_outs}
+
+    tracks = [track for track in order if track in outs[track.src]]
+    return FabricLayer(layer.sources, layer.sinks, layer.routable, tracks)
+
 
 def parse_xml(filepath):
     N = Side.N
@@ -143,10 +236,10 @@ def parse_xml(filepath):
     tree = ET.parse(filepath)
     root = tree.getroot()
 
-    rows, cols, num_tracks, bus_widths = pre_process(root)
+    rows, cols, num_tracks, bus_widths, sites = pre_process(root)
 
     params = {'rows': rows, 'cols': cols, 'num_tracks': num_tracks,
-              'bus_widths': bus_widths, 'sides': sides}
+              'bus_widths': bus_widths, 'sides': sides, 'sites': sites}
 
     for bus_width in bus_widths:
         params['sinks' + bus_width] = dict()
@@ -171,6 +264,7 @@ def pre_process(root):
     cols = 0
     num_tracks = dict()
     bus_widths = set()
+    sites = dict()
     for tile in root:
         # Not assuming tiles are in order
         # Although one would hope they are
@@ -188,9 +282,22 @@ def pre_process(root):
             # note: removing BUS from parsed name -- kinda Hacky
             num_tracks[(c, r, tr[0][3:])] = int(tr[1])
             bus_widths.add(tr[0][3:])
+        sites[(c, r)] = site_kind(tile)
 
     # rows and cols are the number not the index
-    return rows + 1, cols + 1, num_tracks, bus_widths
+    return rows + 1, cols + 1, num_tracks, bus_widths, sites
+
+
+def site_kind(tile):
+    '''
+       Returns the kind of module a tile can implement
+    '''
+    if tile.find('mem') is not None:
+        return 'Mem'
+    elif tile.find('pe') is not None:
+        return 'PE'
+    else:
+        return None
 
 
 def generate_layer(bus_width, params):
@@ -1,5 +1,12 @@
+from .analysis import *
 from .backends import *
+from .cache import *
 from .constraints import *
+from .eco import *
+from .floorplan import *
+from .macros import *
 from .model_readers import *
+from .pathfinder import *
 from .pnr import *
+from .route_pool import *
 
@@ -0,0 +1,328 @@
+'''
+Design and fabric analysis passes
+'''
+from collections import defaultdict
+
+__all__ = ['contracted_nets', 'contracted_neighbors', 'io_sites', 'placement_domains',
+           'fabric_automorphisms', 'interchangeable_modules', 'isomorphic_components']
+
+#hacky -- this is the same function as defined in pnr.constraints
+def _is_placeable(x) : return x.type_ in ('PE', 'IO')
+
+# kinds of fabric site each module type can occupy
+# Note: IO is implemented on a PE tile
+_site_kinds = {
+    'PE'  : {'PE'},
+    'IO'  : {'PE'},
+    'Mem' : {'Mem'},
+}
+
+def _manhattan(p, q):
+    return abs(p[0] - q[0]) + abs(p[1] - q[1])
+
+
+def contracted_nets(design):
+    '''
+        Returns (src, src_port, dst, dst_port, net) for every net with
+        unplaceable modules contracted, as done by the constraint generators
+        Note: a net through an unplaceable module appears once for each half
+    '''
+    contracted = []
+    for net in design.nets:
+        src = net.src
+        dst = net.dst
+        src_port = net.src_port
+        dst_port = net.dst_port
+        if not _is_placeable(src):
+            assert len(src.inputs) <= 1
+            if src.inputs:
+                srcnet = next(iter(src.inputs.values()))
+                src = srcnet.src
+                src_port = srcnet.src_port
+            else:
+                continue
+
+        if not _is_placeable(dst):
+            assert len(dst.outputs) <= 1
+            if dst.outputs:
+                dstnet = next(iter(dst.outputs.values()))
+                dst = dstnet.dst
+                dst_port = dstnet.dst_port
+            else:
+                continue
+
+        contracted.append((src, src_port, dst, dst_port, net))
+    return contracted
+
+
+def contracted_neighbors(design):
+    '''
+        Returns a dict from each placeable module to the set of placeable
+        modules it shares a contracted net with
+    '''
+    neighbors = {module : set() for module in design.modules if _is_placeable(module)}
+    for src, _, dst, _, _ in contracted_nets(design):
+        if src != dst:
+            neighbors[src].add(dst)
+            neighbors[dst].add(src)
+    return neighbors
+
+
+def _routing_layers(fabric, design, layers=None):
+    '''
+        The layers (bus widths) to route, by default every width used by
+        the nets of design.  Raises if the fabric lacks one of them.
+    '''
+    if layers is None:
+        layers = sorted({net.width for net in design.nets})
+    for layer in layers:
+        if not any(k[2] == layer for k in fabric.num_tracks):
+            raise ValueError('Fabric has no {}-bit routing layer'.format(layer))
+    return tuple(layers)
+
+
+def io_sites(fabric):
+    '''
+        Sites IO modules may occupy (matches pin_IO)
+    '''
+    return {(x, y) for (x, y) in fabric.sites if x == 0 or y == 0}
+
+
+def placement_domains(fabric, design, state, dist=None, io=False):
+    '''
+        Computes the candidate sites of every placeable module from
+          - site kind: the tile must be able to implement the module
+          - connectivity: the tile must have the ports the module's nets use
+          - pinned modules in state, which get exactly their site
+          - io_sites for IO modules if io is set (as with pin_IO)
+        If dist is given every contracted net is assumed to span at most
+        dist (1 with nearest_neighbor) and the domains are made arc
+        consistent: a site survives only if every neighbour can still be
+        placed within dist and there are enough sites in range for all
+        the neighbours.  This also bounds the distance from pinned modules.
+    '''
+    domains = dict()
+    for module in filter(_is_placeable, design.modules):
+        if module in state:
+            domains[module] = {tuple(state[module][0])}
+            continue
+        kinds = _site_kinds[module.type_]
+        sites = {site for site, kind in fabric.sites.items() if kind in kinds}
+        if io and module.type_ == 'IO':
+            sites &= io_sites(fabric)
+        domains[module] = sites
+
+    for src, src_port, dst, dst_port, net in contracted_nets(design):
+        layer = fabric[net.width]
+        domains[src] = {site for site in domains[src] if site + (src_port,) in layer.sources}
+        domains[dst] = {site for site in domains[dst] if site + (dst_port,) in layer.sinks}
+
+    if dist is None:
+        return domains
+
+    neighbors = contracted_neighbors(design)
+    changed = True
+    while changed:
+        changed = False
+        for module, sites in domains.items():
+            for site in list(sites):
+                around = set()
+                supported = True
+                for n in neighbors[module]:
+                    support = {s for s in domains[n] if 0 < _manhattan(site, s) <= dist}
+                    if not support:
+                        supported = False
+                        break
+                    around |= support
+
+                if not supported or len(around) < len(neighbors[module]):
+                    sites.discard(site)
+                    changed = True
+
+    return domains
+
+
+def _grid_transforms(cols, rows):
+    yield lambda x, y : (cols - 1 - x, y)
+    yield lambda x, y : (x, rows - 1 - y)
+    yield lambda x, y : (cols - 1 - x, rows - 1 - y)
+    if cols == rows:
+        n = cols
+        yield lambda x, y : (y, x)
+        yield lambda x, y : (n - 1 - y, x)
+        yield lambda x, y : (y, n - 1 - x)
+        yield lambda x, y : (n - 1 - y, n - 1 - x)
+
+
+def _site_ports(fabric):
+    # (x, y) -> {(bus_width, 'source' or 'sink', port)}
+    ports = defaultdict(set)
+    for bus_width in {w for (_, _, w) in fabric.num_tracks}:
+        layer = fabric[bus_width]
+        for (x, y, port) in layer.sources:
+            ports[(x, y)].add((bus_width, 'source', port))
+        for (x, y, port) in layer.sinks:
+            ports[(x, y)].add((bus_width, 'sink', port))
+    return ports
+
+
+def fabric_automorphisms(fabric, state=dict(), io=True):
+    '''
+        Returns the non identity mirrors and rotations of the grid, as dicts
+        from site to site, that preserve site kinds, track counts, the
+        source and sink ports of every layer, the sites of modules pinned
+        in state and, if io, the IO sites
+    '''
+    ios = io_sites(fabric)
+    pinned = {tuple(state[module][0]) for module in state}
+    tracks = defaultdict(dict)
+    for (x, y, bus_width), n in fabric.num_tracks.items():
+        tracks[(x, y)][bus_width] = n
+    ports = _site_ports(fabric)
+
+    automorphisms = []
+    for transform in _grid_transforms(fabric.cols, fabric.rows):
+        sigma = {site : transform(*site) for site in fabric.sites}
+        if all(site == image for site, image in sigma.items()):
+            continue
+        if any(fabric.sites.get(image) != fabric.sites[site]
+               or (io and (site in ios) != (image in ios))
+               or tracks[site] != tracks[image]
+               or ports[site] != ports[image]
+               for site, image in sigma.items()):
+            continue
+        if any(sigma[site] != site for site in pinned):
+            continue
+        automorphisms.append(sigma)
+    return automorphisms
+
+
+def interchangeable_modules(design, state=dict(), domains=None):
+    '''
+        Returns groups (sorted by name) of unpinned placeable modules of the
+        same type connected to the same modules through the same ports and
+        layers (and, if domains from placement_domains are given, with the
+        same domain).  Placement constraints can not tell the modules in a
+        group apart.
+    '''
+    signatures = {module : set() for module in design.modules if _is_placeable(module)}
+    for src, src_port, dst, dst_port, net in contracted_nets(design):
+        signatures[src].add(('out', src_port, dst, dst_port, net.width))
+        signatures[dst].add(('in', dst_port, src, src_port, net.width))
+
+    groups = defaultdict(list)
+    for module, signature in signatures.items():
+        if module not in state:
+            domain = frozenset(domains[module]) if domains is not None else None
+            groups[(module.type_, frozenset(signature), domain)].append(module)
+    return [sorted(group, key=lambda m : m.name) for group in groups.values() if len(group) > 1]
+
+
+def _components(nodes, adj):
+    seen = set()
+    components = []
+    for node in sorted(nodes, key=lambda m : m.name):
+        if node in seen:
+            continue
+        component = []
+        frontier = [node]
+        seen.add(node)
+        while frontier:
+            m = frontier.pop()
+            component.append(m)
+            for n, _ in adj[m]:
+                if n not in seen:
+                    seen.add(n)
+                    frontier.append(n)
+        components.append(component)
+    return components
+
+
+def _wl_colors(components, adj):
+    # Weisfeiler-Lehman refinement, colors are shared by all components
+    colors = {m : m.type_ for component in components for m in component}
+    rounds = max(len(component) for component in components)
+    for _ in range(rounds):
+        signatures = {m : (colors[m], tuple(sorted((label, colors[n]) for n, label in adj[m]))) for m in colors}
+        ids = {sig : idx for idx, sig in enumerate(sorted(set(signatures.values()), key=repr))}
+        refined = {m : ids[signatures[m]] for m in colors}
+        if len(set(refined.values())) == len(set(colors.values())):
+            return refined
+        colors = refined
+    return colors
+
+
+def _match(c1, c2, adj, colors):
+    # backtracking isomorphism search guided by the WL colors
+    edges = lambda m : {(n, label) for n, label in adj[m]}
+    order = sorted(c1, key=lambda m : m.name)
+    mapping = dict()
+    used = set()
+
+    def extend(idx):
+        if idx == len(order):
+            return True
+        m = order[idx]
+        for n in c2:
+            if n in used or colors[n] != colors[m]:
+                continue
+            if all((mapping[k], label) in edges(n) for k, label in edges(m) if k in mapping):
+                mapping[m] = n
+                used.add(n)
+                if extend(idx + 1):
+                    return True
+                del mapping[m]
+                used.discard(n)
+        return False
+
+    return dict(mapping) if extend(0) else None
+
+
+def isomorphic_components(design, max_degree=None, exclude=()):
+    '''
+        Finds repeated structures: connected components of the contracted
+        netlist restricted to PEs, without the modules in exclude and those
+        with more than max_degree neighbours (e.g. shared inputs).
+        Components are grouped by Weisfeiler-Lehman hash and confirmed by an
+        explicit isomorphism.
+        Returns a list of groups of at least two components, each a list of
+        dicts mapping the modules of the first component to the matching
+        modules of a component (the first is the identity)
+    '''
+    neighbors = contracted_neighbors(design)
+    nodes = {m for m in neighbors
+             if m.type_ == 'PE' and m not in exclude
+             and (max_degree is None or len(neighbors[m]) <= max_degree)}
+
+    adj = defaultdict(set)
+    for src, src_port, dst, dst_port, _ in contracted_nets(design):
+        if src in nodes and dst in nodes and src != dst:
+            adj[src].add((dst, ('out', src_port, dst_port)))
+            adj[dst].add((src, ('in', src_port, dst_port)))
+
+    components = [c for c in _components(nodes, adj) if len(c) > 1]
+    if not components:
+        return []
+    colors = _wl_colors(components, adj)
+
+    by_hash = defaultdict(list)
+    for component in components:
+        by_hash[tuple(sorted(colors[m] for m in component))].append(component)
+
+    groups = []
+    for candidates in by_hash.values():
+        # the hash may collide for non isomorphic components
+        while len(candidates) > 1:
+            rep = candidates[0]
+            group = [{m : m for m in rep}]
+            rest = []
+            for component in candidates[1:]:
+                mapping = _match(rep, component, adj, colors)
+                if mapping is None:
+                    rest.append(component)
+                else:
+                    group.append(mapping)
+            if len(group) > 1:
+                groups.append(group)
+            candidates = rest
+    return groups
@@ -10,7 +10,7 @@ from fabric.fabricfuns import parse_name, mapSide
 from fabric import Side
 from util import smart_open, Mask
 
-__all__ = ['write_debug', 'write_route_debug', 'write_bitstream', 'write_xml']
+__all__ = ['write_debug', 'write_route_debug', 'write_bitstream', 'write_xml', 'write_placement', 'write_route', 'write_wirelength']
 
 # -------------------------------------------------
 # write_bitsream consants
@@ -81,6 +81,14 @@ def _write_bitstream(cgra_xml, bitstream, annotate, p_state, r_state):
     # -------------------------------------------------
     # write_bitsream utilities
     # -------------------------------------------------
+    def _check_mux(mux, parent):
+        # nets of one driver share mux settings (see tree_model_reader)
+        # but a mux can only select one source
+        snk = mux.get('snk')
+        used = [src.text for src in mux.findall('src') if (x, y, parent, snk, src.text) in r_state.I]
+        if len(used) > 1:
+            raise ValueError('{} mux {} at ({}, {}) is routed from {}'.format(parent, snk, x, y, ', '.join(used)))
+
     def _proc_cb(cb):
         data = defaultdict(int)
         comment = defaultdict(dict)
@@ -91,6 +99,7 @@ def _write_bitstream(cgra_xml, bitstream, annotate, p_state, r_state):
 
         for mux in cb.findall('mux'):
             snk = mux.get('snk')
+            _check_mux(mux, 'CB')
             for src in mux.findall('src'):
                 if (x, y, 'CB', snk, src.text) in r_state.I:
                     # reg == 0 for all cb
@@ -107,6 +116,7 @@ def _write_bitstream(cgra_xml, bitstream, annotate, p_state, r_state):
 
         for mux in sb.findall('mux'):
             snk = mux.get('snk')
+            _check_mux(mux, 'SB')
             for src in mux.findall('src'):
                 if (x, y, 'SB', snk, src.text) in r_state.I:
                     # if latched
@@ -146,6 +156,20 @@ def _write_bitstream(cgra_xml, bitstream, annotate, p_state, r_state):
                         data[_pe_reg['op']][_read_wire[port]] |=  1 # read from wire
                         comment[_pe_reg['op']][_read_wire[port]]  = 'read from wire `{}`'.format(port)
 
+                # 1-bit input (routed on the 1-bit layer)
+                if 'd' in mod.inputs:
+                    src = mod.inputs['d'].src
+
+                    if src.type_ == 'Const':
+                        raise ValueError('Constant 1-bit input to {} is not supported'.format(mod.name))
+                    elif src.type_ == 'Reg':
+                        data[_pe_reg['op']][_load_reg['d']] |= 1 # load reg with wire
+                        comment[_pe_reg['op']][_load_reg['d']] = 'load `d` reg with wire'
+                        comment[_pe_reg['op']][_read_wire['d']] = 'read from reg `d`'
+                    else:
+                        data[_pe_reg['op']][_read_wire['d']] |=  1 # read from wire
+                        comment[_pe_reg['op']][_read_wire['d']]  = 'read from wire `d`'
+
             elif mod.type_ == 'IO':
                 data[_pe_reg['op']] = _op_codes[mod.config]
 
@@ -249,6 +273,58 @@ def _write_route_debug(design, output, p_state, r_state):
             f.write('{} -> {}:\n'.format(net.src.name, net.dst.name))
             f.write(str(r_state[(net, 'debug')]))
             f.write("\n")
+            if (net, 'tree') in r_state:
+                f.write('tree: {} tracks shared by the sinks of {}\n'.format(len(r_state[(net, 'tree')]), net.src.name))
+
+
+def write_wirelength(design, output=sys.stdout):
+    return partial(_write_wirelength, design, output)
+
+def _write_wirelength(design, output, p_state, r_state):
+    '''
+       Number of tracks used by every routed net and in total, where the
+       total counts tracks shared by the sinks of a driver once
+    '''
+    used = set()
+    with smart_open(output, 'w') as f:
+        for net in design.nets:
+            if net not in r_state:
+                continue
+            states = r_state[net]
+            used.update(states)
+            f.write('{} -> {}: {}\n'.format(net.src.name, net.dst.name, len(states)))
+        f.write('total: {}\n'.format(len(used)))
+
+
+def write_placement(output):
+    return partial(_write_placement, output)
+
+def _write_placement(output, p_state, r_state):
+    '''
+       One module per line: name x y
+       Can be read back with read_placement
+    '''
+    with smart_open(output, 'w') as f:
+        for module in sorted(p_state, key=lambda m : m.name):
+            f.write('{} {} {}\n'.format(module.name, *p_state[module][0]))
+
+
+def write_route(output):
+    return partial(_write_route, output)
+
+def _write_route(output, p_state, r_state):
+    '''
+       One routing resource per line:
+       src src_port dst dst_port x y parent outname inname
+       Can be read back with read_route
+    '''
+    with smart_open(output, 'w') as f:
+        for net in r_state:
+            # skip the debug entries
+            if isinstance(net, tuple):
+                continue
+            for state in r_state[net]:
+                f.write('{} {} {} {} {} {} {} {} {}\n'.format(net.src.name, net.src_port, net.dst.name, net.dst_port, *state))
 
 
 def write_xml(inpath, outpath, io_outpath):
@@ -0,0 +1,128 @@
+'''
+On disk cache of placement results
+
+Entries are keyed by a fingerprint of the contracted netlist, the fabric,
+the pinned modules and the constraint generators (with their parameters).
+'''
+from functools import partial
+import hashlib
+import json
+import os
+import time
+from util import NamedIDObject
+from .analysis import contracted_nets, _is_placeable
+
+__all__ = ['PlacementCache']
+
+def _value_fingerprint(value):
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    elif isinstance(value, NamedIDObject):
+        return value.name
+    elif isinstance(value, (tuple, list)):
+        return [_value_fingerprint(v) for v in value]
+    elif isinstance(value, (set, frozenset)):
+        return sorted((_value_fingerprint(v) for v in value), key=json.dumps)
+    elif isinstance(value, dict):
+        return sorted(([_value_fingerprint(k), _value_fingerprint(v)] for k, v in value.items()), key=json.dumps)
+    elif callable(value):
+        return _fun_fingerprint(value)
+    else:
+        # solvers and the like only contribute their type
+        return type(value).__qualname__
+
+
+def _fun_fingerprint(fun):
+    if isinstance(fun, partial):
+        return [_fun_fingerprint(fun.func),
+                _value_fingerprint(fun.args),
+                _value_fingerprint(fun.keywords)]
+    name = '{}.{}'.format(getattr(fun, '__module__', ''), getattr(fun, '__qualname__', type(fun).__qualname__))
+    cells = getattr(fun, '__closure__', None) or ()
+    return [name, [_value_fingerprint(cell.cell_contents) for cell in cells]]
+
+
+def _design_fingerprint(design):
+    modules = sorted([m.name, m.type_] for m in design.modules if _is_placeable(m))
+    nets = {(src.name, src_port, dst.name, dst_port, net.width) for src, src_port, dst, dst_port, net in contracted_nets(design)}
+    return [modules, sorted(nets)]
+
+
+def _fabric_fingerprint(fabric):
+    h = hashlib.sha256()
+    h.update(json.dumps([fabric.rows, fabric.cols,
+                         _value_fingerprint(fabric.sites),
+                         _value_fingerprint(fabric.num_tracks)]).encode())
+    for bus_width in sorted({k[2] for k in fabric.num_tracks}):
+        for name in sorted(track.name for track in fabric[bus_width].tracks):
+            h.update(name.encode())
+    return h.hexdigest()
+
+
+class PlacementCache:
+    '''
+        Maps keys (see key) to placements {module name : (x, y)}, or None for
+        constraint sets that were unsatisfiable
+        max_entries : evict least recently used entries beyond this many
+        max_age     : evict entries not used for this many seconds
+    '''
+    def __init__(self, path, max_entries=None, max_age=None):
+        self._path = path
+        self._max_entries = max_entries
+        self._max_age = max_age
+        os.makedirs(path, exist_ok=True)
+
+    def key(self, fabric, design, state, funcs):
+        pinned = sorted([module.name, list(state[module][0])] for module in state)
+        data = [_design_fingerprint(design), _fabric_fingerprint(fabric), pinned, [_fun_fingerprint(f) for f in funcs]]
+        return hashlib.sha256(json.dumps(data).encode()).hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self._path, key + '.json')
+
+    def __contains__(self, key):
+        return os.path.exists(self._file(key))
+
+    def __getitem__(self, key):
+        file = self._file(key)
+        try:
+            with open(file) as f:
+                placement = json.load(f)
+        except (OSError, ValueError):
+            raise KeyError(key)
+        # mark as recently used, the entry may have been evicted meanwhile
+        try:
+            os.utime(file)
+        except OSError:
+            pass
+        if placement is None:
+            return None
+        return {name : tuple(pos) for name, pos in placement.items()}
+
+    def __setitem__(self, key, placement):
+        file = self._file(key)
+        tmp = '{}.{}.tmp'.format(file, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(placement, f)
+        os.replace(tmp, file)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self._path):
+            if name.endswith('.json'):
+                file = os.path.join(self._path, name)
+                try:
+                    entries.append((os.path.getmtime(file), file))
+                except OSError:
+                    pass
+        entries.sort(reverse=True)
+
+        now = time.time()
+        for idx, (mtime, file) in enumerate(entries):
+            if ((self._max_entries is not None and idx >= self._max_entries)
+                    or (self._max_age is not None and now - mtime > self._max_age)):
+                try:
+                    os.remove(file)
+                except OSError:
+                    pass
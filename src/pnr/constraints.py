@@ -1,14 +1,27 @@
 '''
 Constraint generators
 '''
+from collections import defaultdict
 from functools import partial
 from smt_switch import functions
+import smt.z3util as zu
+from smt.position import Offset
+from .analysis import placement_domains, contracted_nets, contracted_neighbors, fabric_automorphisms, interchangeable_modules
 
 And = functions.And()
 Or = functions.Or()
+bvult = functions.bvult()
+bvule = functions.bvule()
 
 def _is_placeable(x) : return x.type_ in ('PE', 'IO')
 
+# input ports of a PE on each routing layer
+# TODO: don't hardcode these -- get from coreir?
+_layer_ports = {
+    16 : ('a', 'b'),
+    1  : ('d',),
+}
+
 _f_placable = partial(filter, _is_placeable)
 
 
@@ -27,19 +40,58 @@ def init_positions(position_type):
         return And(constraints)
     return initializer
 
+def init_macros(position_type, macros):
+    '''
+    init_macros:
+        place initializer for macros, the anchor of each macro gets a
+        position and every other module a view of it (see smt.Offset)
+        Must come before init_positions
+    '''
+    # only keep the offsets so placement cache keys see the macro contents
+    offsets = [macro.offsets for macro in macros]
+    extents = [(macro.name, macro.extent) for macro in macros]
+    def initializer(fabric, design, state, vars, solver):
+        for name, (width, height) in extents:
+            if width > fabric.cols or height > fabric.rows:
+                raise ValueError('Macro {} ({}x{}) does not fit on the {}x{} fabric'.format(
+                    name, width, height, fabric.cols, fabric.rows))
+        constraints = []
+        for offs in offsets:
+            anchor = next(module for module, d in offs.items() if d == (0, 0))
+            if anchor not in vars:
+                p = position_type(anchor.name, fabric)
+                vars[anchor] = p
+                constraints.append(p.invariants)
+            for module, (dx, dy) in offs.items():
+                if module not in vars:
+                    p = Offset(vars[anchor], dx, dy)
+                    vars[module] = p
+                    constraints.append(p.invariants)
+        return And(constraints)
+    return initializer
+
+def _macro_modules(vars):
+    # modules sharing their position variables with another module
+    anchors = defaultdict(list)
+    for module, pos in vars.items():
+        anchors[pos.anchor].append(module)
+    return {module for group in anchors.values() if len(group) > 1 for module in group}
+
 def assert_pinned(fabric, design, state, vars, solver):
     constraints = []
     for module in _f_placable(design.modules):
         if module in state:
             pos = vars[module]
-            constraints.append(pos == pos.encode(state[module][0]))
+            x, y = state[module][0]
+            constraints.append(And(pos.x == pos.encode_x(x), pos.y == pos.encode_y(y)))
     return And(constraints)
 
 def distinct(fabric, design, state, vars, solver):
     constraints = []
     for m1 in _f_placable(design.modules):
         for m2 in _f_placable(design.modules):
-            if m1 != m2:
+            # modules of a macro can not overlap by construction
+            if m1 != m2 and vars[m1].anchor is not vars[m2].anchor:
                 constraints.append(vars[m1].flat != vars[m2].flat)
     return And(constraints)
 
@@ -83,6 +135,148 @@ def pin_IO(fabric, design, state, vars, solver):
     return And(constraints)
 
 
+def prune_domains(dist=None, io=False):
+    '''
+    prune_domains:
+        restricts every placeable module to its candidate sites (see placement_domains)
+        dist must not be tighter than the other generators guarantee,
+        i.e. 1 with nearest_neighbor and None without it
+        io restricts IO modules to io_sites, only use it with pin_IO
+    '''
+    def domain_constraints(fabric, design, state, vars, solver):
+        constraints = []
+        for module, sites in placement_domains(fabric, design, state, dist, io).items():
+            constraints.append(vars[module].restrict(sites))
+        return And(constraints)
+    return domain_constraints
+
+def confine(sites):
+    '''
+    confine:
+        restricts modules to site sets
+        sites is a dict Module -> {(x, y)}
+    '''
+    def confine_constraints(fabric, design, state, vars, solver):
+        return And([vars[module].restrict(s) for module, s in sites.items()])
+    return confine_constraints
+
+def compact(groups, width, height):
+    '''
+    compact:
+        every group of modules must fit in a width x height window
+    '''
+    def compact_constraints(fabric, design, state, vars, solver):
+        constraints = []
+        for group in groups:
+            positions = [vars[m] for m in group if m in vars]
+            if width < fabric.cols:
+                constraints.append(Or([And([p.in_x(range(x, x + width)) for p in positions])
+                                       for x in range(fabric.cols - width + 1)]))
+            if height < fabric.rows:
+                constraints.append(Or([And([p.in_y(range(y, y + height)) for p in positions])
+                                       for y in range(fabric.rows - height + 1)]))
+        return And(constraints)
+    return compact_constraints
+
+def congestion(factor=1, layer=16):
+    '''
+    congestion:
+        estimates the routing demand of a tile as the number of nets (a
+        driver and all of its sinks) whose bounding box covers the tile and
+        bounds it by factor times the number of tracks of the tile
+    '''
+    def congestion_constraints(fabric, design, state, vars, solver):
+        nets = defaultdict(set)
+        for src, src_port, dst, _, net in contracted_nets(design):
+            if net.width == layer and src != dst:
+                nets[(src, src_port)] |= {src, dst}
+
+        constraints = []
+        for (x, y) in fabric.sites:
+            capacity = int(factor * fabric.num_tracks[(x, y, layer)])
+            if capacity >= len(nets):
+                continue
+
+            covers = []
+            for terminals in nets.values():
+                positions = [vars[m] for m in terminals]
+                covers.append(And(Or([p.in_x(range(0, x + 1)) for p in positions]),
+                                  Or([p.in_x(range(x, fabric.cols)) for p in positions]),
+                                  Or([p.in_y(range(0, y + 1)) for p in positions]),
+                                  Or([p.in_y(range(y, fabric.rows)) for p in positions])))
+            constraints.append(bvule(zu.count(covers, solver), capacity))
+
+        return And(constraints)
+    return congestion_constraints
+
+def _swaps_axes(sigma):
+    # whether sites of one row are mapped to different rows
+    rows = defaultdict(set)
+    for (x, y), image in sigma.items():
+        rows[y].add(image[1])
+    return any(len(images) > 1 for images in rows.values())
+
+def break_symmetries(sites=dict(), groups=(), window=None):
+    '''
+    break_symmetries:
+        lex-leader constraints for every fabric automorphism and a strict
+        order on interchangeable modules
+        Sites are ordered by (x, y) which is the order of flat for every position type
+        Macros are not invariant under mirrors and rotations so with macros
+        only modules outside of them are ordered
+        sites (as passed to confine) and groups and window (the arguments of
+        compact) must be given when those generators are used, only the
+        symmetries preserving them are broken
+    '''
+    def symmetry_constraints(fabric, design, state, vars, solver):
+        constraints = []
+        in_macros = _macro_modules(vars)
+        neighbors = contracted_neighbors(design)
+        order = sorted((m for m in neighbors if m not in state), key=lambda m : (-len(neighbors[m]), m.name))
+
+        def at(module, site):
+            pos = vars[module]
+            return And(pos.x == pos.encode_x(site[0]), pos.y == pos.encode_y(site[1]))
+
+        def preserved(sigma):
+            if any({sigma.get(site, site) for site in s} != set(s) for s in sites.values()):
+                return False
+            # a window is mapped to a window of the transposed shape
+            return not (groups and window[0] != window[1] and _swaps_axes(sigma))
+
+        has_io = any(m.type_ == 'IO' for m in design.modules)
+        automorphisms = [] if in_macros else fabric_automorphisms(fabric, state, has_io)
+        for sigma in filter(preserved, automorphisms):
+            smaller = [site for site, image in sigma.items() if site < image]
+            fixed = [site for site, image in sigma.items() if site == image]
+            # without fixed points the first module always decides
+            chain = order if fixed else order[:1]
+
+            # chain <=lex sigma(chain), built back to front
+            lex = None
+            for module in reversed(chain):
+                lt = Or([at(module, site) for site in smaller])
+                if lex is None:
+                    lex = Or(lt, Or([at(module, site) for site in fixed])) if fixed else lt
+                else:
+                    lex = Or(lt, And(Or([at(module, site) for site in fixed]), lex))
+            if lex is not None:
+                constraints.append(lex)
+
+        for group in interchangeable_modules(design, state, placement_domains(fabric, design, state)):
+            # only modules with the same restrictions can be swapped
+            restricted = defaultdict(list)
+            for m in group:
+                if m not in in_macros:
+                    key = frozenset(sites.get(m, ())), tuple(m in g for g in groups)
+                    restricted[key].append(m)
+            for group in restricted.values():
+                for m1, m2 in zip(group, group[1:]):
+                    constraints.append(bvult(vars[m1].flat, vars[m2].flat))
+
+        return And(constraints)
+    return symmetry_constraints
+
 
 #################################### Routing Constraints ################################
 
@@ -92,51 +286,29 @@ def excl_constraints(fabric, design, p_state, r_state, vars, solver, layer=16):
         Works with build_msgraph, reachability and dist_limit
     '''
     c = []
-    graph = solver.graphs[0]
-    # TODO: don't hardcode these -- get from coreir?
-    ports = {'a', 'b'}
+    graph = vars[('graph', layer)]
+    ports = set(_layer_ports[layer])
 
     sources = fabric[layer].sources
     sinks = fabric[layer].sinks
 
     # for connected modules, make sure it's not connected to wrong inputs
-    # TODO: Fix this so doesn't assume only connected to one input port
-    # there might be weird cases where you want to drive multiple inputs
-    # of dst module with one output
-    for net in design.nets:
-        src = net.src
-        dst = net.dst
-        src_port = net.src_port
-        dst_port = net.dst_port
-        # contract nets with unplaced modules
-        # Note: This results in repeated constraints
-        if not _is_placeable(src):
-            assert len(src.inputs) <= 1
-            if src.inputs:
-                srcnet = next(iter(src.inputs.values()))
-                src = srcnet.src
-                src_port = srcnet.src_port
-            else:
-                continue
-
-        if not _is_placeable(dst):
-            assert len(dst.outputs) <= 1
-            if dst.outputs:
-                dstnet = next(iter(dst.outputs.values()))
-                dst = dstnet.dst
-                dst_port = dstnet.dst_port
-            else:
-                continue
+    # a driver may feed several inputs of the same module (one route tree)
+    driven = defaultdict(set)
+    for src, src_port, dst, dst_port, net in contracted_nets(design):
+        if net.width == layer:
+            driven[(src, src_port, dst)].add(dst_port)
 
+    for (src, src_port, dst), dst_ports in driven.items():
         src_pos = p_state[src][0]
         dst_pos = p_state[dst][0]
 
-        for port in ports - set(dst_port):
-            c.append(~vars[net].reaches(vars[sources[src_pos + (src_port,)]], vars[sinks[dst_pos + (port,)]]))
+        for port in ports - dst_ports:
+            c.append(~graph.reaches(vars[sources[src_pos + (src_port,)]], vars[sinks[dst_pos + (port,)]]))
 
     # make sure modules that aren't connected are not connected
     for m1 in _f_placable(design.modules):
-        inputs = {x.src for x in m1.inputs.values()}
+        inputs = {x.src for x in m1.inputs.values() if x.width == layer}
         contracted_inputs = set()
         for src in inputs:
             if not _is_placeable(src):
@@ -160,6 +332,41 @@ def excl_constraints(fabric, design, p_state, r_state, vars, solver, layer=16):
     return solver.And(c)
 
 
+def excl_amo(fabric, design, p_state, r_state, vars, solver, layer=16):
+    '''
+        Linear size alternative to excl_constraints for build_msgraph
+        At most one in-edge of every node may be enabled so every node is
+        reached from at most one source, and the sink ports of placed
+        modules that no net uses are disconnected
+    '''
+    in_edges = defaultdict(list)
+    for track, e in _track_edges(vars, layer).items():
+        in_edges[track.dst].append(e)
+
+    # asserted directly, so only once per graph
+    graph = vars[('graph', layer)]
+    if ('amo', graph) not in solver.cache:
+        solver.cache[('amo', graph)] = True
+        for edges in in_edges.values():
+            if len(edges) > 1:
+                solver.AssertAtMostOne(edges)
+
+    ports = set(_layer_ports[layer])
+    used = defaultdict(set)
+    for _, _, dst, dst_port, net in contracted_nets(design):
+        if net.width == layer:
+            used[dst].add(dst_port)
+
+    sinks = fabric[layer].sinks
+    c = []
+    for module in _f_placable(design.modules):
+        pos = p_state[module][0]
+        for port in ports - used[module]:
+            if pos + (port,) in sinks:
+                c.extend(~e for e in in_edges[sinks[pos + (port,)]])
+    return solver.And(c)
+
+
 def reachability(fabric, design, p_state, r_state, vars, solver, layer=16):
     '''
         Enforce reachability for nets in single graph encoding
@@ -169,6 +376,8 @@ def reachability(fabric, design, p_state, r_state, vars, solver, layer=16):
     sources = fabric[layer].sources
     sinks = fabric[layer].sinks
     for net in design.nets:
+        if net.width != layer:
+            continue
         src = net.src
         dst = net.dst
         src_port = net.src_port
@@ -203,6 +412,29 @@ def reachability(fabric, design, p_state, r_state, vars, solver, layer=16):
     return solver.And(reaches)
 
 
+def guarded_reachability(fabric, design, p_state, r_state, vars, solver, layer=16):
+    '''
+        reachability with every net guarded by an assumption literal
+        (vars[(net, 'guard')]) so that the nets responsible for a failed
+        routing can be recovered from the solver. Replaces reachability
+    '''
+    c = []
+    sources = fabric[layer].sources
+    sinks = fabric[layer].sinks
+    for src, src_port, dst, dst_port, net in contracted_nets(design):
+        if net.width != layer:
+            continue
+        src_pe = sources[p_state[src][0] + (src_port,)]
+        dst_pe = sinks[p_state[dst][0] + (dst_port,)]
+
+        guard = solver.var()
+        vars[(net, 'guard')] = guard
+        solver.assume(guard)
+        c.append(solver.Or(~guard, vars[net].reaches(vars[src_pe], vars[dst_pe])))
+
+    return solver.And(c)
+
+
 def dist_limit(dist_factor):
     '''
        Enforce a global distance constraint. Works with single or multi graph encoding
@@ -217,6 +449,8 @@ def dist_limit(dist_factor):
         sources = fabric[layer].sources
         sinks = fabric[layer].sinks
         for net in design.nets:
+            if net.width != layer:
+                continue
             src = net.src
             dst = net.dst
             src_port = net.src_port
@@ -258,42 +492,209 @@ def dist_limit(dist_factor):
     return dist_constraints
 
 
+def dist_schedule(factors):
+    '''
+       dist_limit with escalating distance factors in one graph
+       The bound of each factor is guarded by a stage literal and the route
+       solver tries the factors in order, None stands for no bound
+       Replaces dist_limit
+    '''
+    for factor in factors:
+        if factor is not None and not isinstance(factor, int):
+            raise ValueError('Expected integer distance factor. Received {}'.format(type(factor)))
+
+    def schedule_constraints(fabric, design, p_state, r_state, vars, solver, layer=16):
+        c = []
+        for factor in factors:
+            guard = solver.var()
+            solver.add_stage(guard)
+            if factor is not None:
+                bound = dist_limit(factor)(fabric, design, p_state, r_state, vars, solver, layer)
+                c.append(solver.Or(~guard, bound))
+        return solver.And(c)
+    return schedule_constraints
+
+
+def min_wirelength(fabric, design, p_state, r_state, vars, solver, layer=16):
+    '''
+       Minimizes the total number of tracks used on the layer (the total
+       of write_wirelength) by bisecting a pseudo-Boolean bound on the
+       enabled track edges under assumptions (see Solver_monosat.minimize).
+       Contracted chains count as all of their tracks.  Works with
+       build_msgraph or bounded_msgraph and must come after it.
+    '''
+    tracks = _track_edges(vars, layer)
+    edges = list(tracks.values())
+    weights = [len(track.expand()) for track in tracks]
+    solver.minimize([(partial(_enabled_weight, edges, weights),
+                      partial(solver.AtMost, edges, weights=weights))])
+    return solver.And([])
+
+
+def _enabled_weight(edges, weights):
+    return sum(w for e, w in zip(edges, weights) if e.value())
+
+
+def min_net_wirelength(fabric, design, p_state, r_state, vars, solver, layer=16):
+    '''
+       Alternative to min_wirelength minimizing the number of tracks on the
+       path of every net, one net after the other in a fixed order, by
+       tightening distance bounds.  Each path is made as short as possible
+       given the earlier ones, so the total is not minimized.  Works with
+       build_msgraph and reachability.
+    '''
+    costs = []
+    sources = fabric[layer].sources
+    sinks = fabric[layer].sinks
+    for src, src_port, dst, dst_port, net in contracted_nets(design):
+        if net.width != layer:
+            continue
+        graph = vars[net]
+        src_pe = vars[sources[p_state[src][0] + (src_port,)]]
+        dst_pe = vars[sinks[p_state[dst][0] + (dst_port,)]]
+        costs.append((partial(_path_length, graph, graph.reaches(src_pe, dst_pe)),
+                      partial(graph.distance_leq, src_pe, dst_pe)))
+    solver.minimize(costs)
+    return solver.And([])
+
+
+def _path_length(graph, reaches):
+    return len(graph.getPath(reaches)) - 1
+
+
+def pin_routes(routes, placement):
+    '''
+       Reuses the previous route of every net whose (contracted) endpoints
+       are still where they were. Works with build_msgraph
+       routes    : {Net : [(x, y, parent, outname, inname)]} as from read_route
+       placement : {Module : (x, y)} the placement routes was found for
+    '''
+    def pin_constraints(fabric, design, p_state, r_state, vars, solver, layer=16):
+        # a contracted chain is pinned if all of its tracks were used
+        edges = defaultdict(list)
+        for track, e in _track_edges(vars, layer).items():
+            states = tuple((t.src.x, t.src.y, t.parent, t.track_names[1], t.track_names[0]) for t in track.expand())
+            edges[states[0]].append((states, e))
+
+        c = []
+        for src, _, dst, _, net in contracted_nets(design):
+            if net not in routes or net.width != layer:
+                continue
+            if any(placement.get(m) != tuple(p_state[m][0]) for m in (src, dst)):
+                continue
+            route = set(routes[net])
+            for state in route:
+                for states, e in edges[state]:
+                    if route.issuperset(states):
+                        c.append(e)
+        return solver.And(c)
+    return pin_constraints
+
+
 def build_msgraph(fabric, design, p_state, r_state, vars, solver, layer=16):
+    '''
+       Routing graph of the whole layer (every PE of the fabric).  It does
+       not depend on the placement, so it is built once per solver and
+       layer and reused by later routing attempts (see Solver_monosat.push)
+    '''
+    graph = _layer_graph(fabric, vars, solver, layer)
     # to comply with multigraph, add graph for each net
     # note: in this case, all point to the same graph
     # this allows us to reuse constraints such as dist_limit and use the same model_reader
-    solver.add_graph()
     for net in design.nets:
-        vars[net] = solver.graphs[0]
+        vars[net] = graph
+    return solver.And([])
 
-    graph = solver.graphs[0]  # only one graph in this encoding
 
-    sources = fabric[layer].sources
-    sinks = fabric[layer].sinks
+def bounded_msgraph(margin):
+    '''
+       build_msgraph restricted to the tracks within the union of the net
+       bounding boxes grown by margin tiles (the whole layer if margin is
+       None).  The smaller graph is kept for later attempts with the same
+       region.  See PNR.route_bounded for growing the margin on failure
+    '''
+    def build_bounded(fabric, design, p_state, r_state, vars, solver, layer=16):
+        if margin is None:
+            return build_msgraph(fabric, design, p_state, r_state, vars, solver, layer)
 
-    # add msnodes for all the used PEs first (because special naming scheme)
-    # Hacky! Hardcoding port names
-    for x in range(fabric.width):
-        for y in range(fabric.height):
-            if (x, y) in p_state.I:
-                vars[sinks[(x, y, 'a')]] = graph.addNode('({},{})PE_a'.format(x, y))
-                vars[sinks[(x, y, 'b')]] = graph.addNode('({},{})PE_b'.format(x, y))
-                vars[sources[(x, y, 'out')]] = graph.addNode('({},{})PE_out'.format(x, y))
+        region = set()
+        for src, _, dst, _, net in contracted_nets(design):
+            if net.width != layer:
+                continue
+            (x0, y0), (x1, y1) = p_state[src][0], p_state[dst][0]
+            for x in range(max(min(x0, x1) - margin, 0), min(max(x0, x1) + margin + 1, fabric.cols)):
+                for y in range(max(min(y0, y1) - margin, 0), min(max(y0, y1) + margin + 1, fabric.rows)):
+                    region.add((x, y))
 
-    for track in fabric[layer].tracks:
-        src = track.src
-        dst = track.dst
-        # naming scheme is (x, y)Side_direction[track]
-        if src not in vars:
-            vars[src] = graph.addNode(src.name)
-        if dst not in vars:
-            vars[dst] = graph.addNode(dst.name)
+        graph = _layer_graph(fabric, vars, solver, layer, frozenset(region))
+        for net in design.nets:
+            vars[net] = graph
+        return solver.And([])
+    return build_bounded
 
-        # create a monosat edge
-        e = graph.addEdge(vars[src], vars[dst])
-        vars[e] = track  # we need to recover the track in model_reader
 
-    return solver.And([])
+def _layer_graph(fabric, vars, solver, layer, region=None):
+    '''
+        The routing graph of a layer with only the tracks inside region (a
+        frozenset of sites, None for every track), built once per solver,
+        layer and region (kept in solver.cache until the solver is reset).
+        The graph is made the current one of the layer:
+        vars[('graph', layer)] is the graph, vars[port] its node for every
+        PE port (every graph has the nodes of all PE ports) and vars[e] the
+        track of each of its edges
+    '''
+    key = ('graph', layer, region)
+    if key not in solver.cache:
+        graph = solver.add_graph()
+
+        sources = fabric[layer].sources
+        sinks = fabric[layer].sinks
+        nodes = dict()
+        edges = dict()
+
+        # add msnodes for all the PEs first (because special naming scheme)
+        # Hacky! Hardcoding port names
+        for x in range(fabric.width):
+            for y in range(fabric.height):
+                if (x, y, 'out') in sources:
+                    for port in _layer_ports[layer]:
+                        if (x, y, port) in sinks:
+                            nodes[sinks[(x, y, port)]] = graph.addNode('({},{})PE_{}'.format(x, y, port))
+                    nodes[sources[(x, y, 'out')]] = graph.addNode('({},{})PE_out'.format(x, y))
+
+        for track in fabric[layer].tracks:
+            if region is not None and any(t.src.loc not in region or t.dst.loc not in region for t in track.expand()):
+                continue
+            src = track.src
+            dst = track.dst
+            # naming scheme is (x, y)Side_direction[track]
+            if src not in nodes:
+                nodes[src] = graph.addNode(src.name)
+            if dst not in nodes:
+                nodes[dst] = graph.addNode(dst.name)
+
+            # create a monosat edge
+            edges[track] = graph.addEdge(nodes[src], nodes[dst])
+
+        solver.cache[key] = graph, tuple(nodes.items()), tuple(edges.items())
+
+    graph, nodes, edges = solver.cache[key]
+    if vars.get(('graph', layer)) is not graph:
+        # only the edges of the current graph are kept in vars
+        for _, e in vars.get(('edges', layer), ()):
+            del vars[e]
+        for track, e in edges:
+            vars[e] = track  # we need to recover the track in model_reader
+        vars[('edges', layer)] = edges
+        vars[('graph', layer)] = graph
+    for port, node in nodes:
+        vars[port] = node
+    return graph
+
+
+def _track_edges(vars, layer):
+    # track -> edge of the current graph of the layer
+    return dict(vars[('edges', layer)])
 
 
 def build_net_graphs(fabric, design, p_state, r_state, vars, solver, layer=16):
@@ -0,0 +1,99 @@
+'''
+Engineering change order (ECO) support: reading back previous results and
+finding what changed between two versions of a design
+'''
+from collections import defaultdict
+from util import smart_open
+from .analysis import contracted_neighbors
+
+__all__ = ['read_placement', 'read_route', 'design_diff', 'eco_window']
+
+def _net_key(net):
+    return (net.src.name, net.src_port, net.dst.name, net.dst_port)
+
+
+def _lines(file):
+    with smart_open(file) as f:
+        for line in f:
+            line = line.split('#')[0].split()
+            if line:
+                yield line
+
+
+def read_placement(design, file):
+    '''
+        Reads a placement written by write_placement
+        Returns {Module : (x, y)} for the modules of design that appear in file
+    '''
+    modules = {module.name : module for module in design.modules}
+    placement = dict()
+    for name, x, y in _lines(file):
+        if name in modules:
+            placement[modules[name]] = (int(x), int(y))
+    return placement
+
+
+def read_route(design, file):
+    '''
+        Reads a routing written by write_route
+        Returns {Net : [(x, y, parent, outname, inname)]} for the nets of design
+        that appear in file
+    '''
+    nets = {_net_key(net) : net for net in design.nets}
+    routes = defaultdict(list)
+    for src, src_port, dst, dst_port, x, y, parent, outname, inname in _lines(file):
+        net = nets.get((src, src_port, dst, dst_port))
+        if net is not None:
+            routes[net].append((int(x), int(y), parent, outname, inname))
+    return routes
+
+
+def _signatures(design):
+    sigs = defaultdict(set)
+    for net in design.nets:
+        sigs[net.src.name].add(('out',) + _net_key(net))
+        sigs[net.dst.name].add(('in',) + _net_key(net))
+    return sigs
+
+
+def design_diff(old, new):
+    '''
+        Returns the modules of new that were added or changed (type, config
+        or connections) with respect to old
+    '''
+    old_modules = {module.name : module for module in old.modules}
+    old_sigs = _signatures(old)
+    new_sigs = _signatures(new)
+
+    changed = set()
+    for module in new.modules:
+        prev = old_modules.get(module.name)
+        if (prev is None
+                or prev.type_ != module.type_
+                or prev.config != module.config
+                or old_sigs[module.name] != new_sigs[module.name]):
+            changed.add(module)
+    return changed
+
+
+def eco_window(design, changed, radius):
+    '''
+        Returns the placeable modules within radius contracted nets of a
+        changed module.  A changed unplaceable module (e.g. a Const) marks
+        the placeable modules it is connected to.
+    '''
+    neighbors = contracted_neighbors(design)
+    seeds = set()
+    for module in changed:
+        if module in neighbors:
+            seeds.add(module)
+        else:
+            seeds |= {net.dst for net in module.outputs.values() if net.dst in neighbors}
+            seeds |= {net.src for net in module.inputs.values() if net.src in neighbors}
+
+    window = set(seeds)
+    frontier = seeds
+    for _ in range(radius):
+        frontier = {n for m in frontier for n in neighbors[m]} - window
+        window |= frontier
+    return window
@@ -0,0 +1,65 @@
+'''
+Floorplans: regions of the fabric that groups of modules must be placed in
+'''
+from fnmatch import fnmatchcase
+from util import smart_open
+from .analysis import _is_placeable
+
+__all__ = ['read_floorplan']
+
+def _parse_region(fabric, kind, args):
+    if kind == 'rect':
+        # inclusive corners
+        x0, y0, x1, y1 = map(int, args)
+        return {(x, y) for (x, y) in fabric.sites
+                if min(x0, x1) <= x <= max(x0, x1) and min(y0, y1) <= y <= max(y0, y1)}
+    elif kind == 'rows':
+        y0, y1 = map(int, args)
+        return {(x, y) for (x, y) in fabric.sites if y0 <= y <= y1}
+    elif kind == 'cols':
+        x0, x1 = map(int, args)
+        return {(x, y) for (x, y) in fabric.sites if x0 <= x <= x1}
+    elif kind == 'sites':
+        sites = {tuple(map(int, site.split(','))) for site in args}
+        return sites & set(fabric.sites)
+    else:
+        raise ValueError('Unknown region kind: {}'.format(kind))
+
+
+def read_floorplan(design, fabric, file):
+    '''
+        Reads a floorplan made of region and group lines:
+            region <name> rect <x0> <y0> <x1> <y1>
+            region <name> rows <y0> <y1>
+            region <name> cols <x0> <x1>
+            region <name> sites <x>,<y> ...
+            group <region> <module pattern> ...
+        Bounds are inclusive and module patterns are shell style.  A region
+        may be used by several groups and a module in several groups must be
+        in all of their regions.
+        Returns {Module : {(x, y)}}, for use with confine
+    '''
+    regions = dict()
+    sites = dict()
+    modules = sorted(filter(_is_placeable, design.modules), key=lambda m : m.name)
+    with smart_open(file) as f:
+        for line in f:
+            line = line.split('#')[0].split()
+            if not line:
+                continue
+            if line[0] == 'region':
+                name, kind = line[1:3]
+                regions[name] = _parse_region(fabric, kind, line[3:])
+            elif line[0] == 'group':
+                name = line[1]
+                if name not in regions:
+                    raise ValueError('Unknown region: {}'.format(name))
+                for pattern in line[2:]:
+                    matched = [m for m in modules if fnmatchcase(m.name, pattern)]
+                    if not matched:
+                        raise ValueError('No placeable module matches {}'.format(pattern))
+                    for module in matched:
+                        sites[module] = sites.get(module, regions[name]) & regions[name]
+            else:
+                raise ValueError('Unknown floorplan entry: {}'.format(line[0]))
+    return sites
@@ -0,0 +1,77 @@
+'''
+Relative placement macros: groups of modules placed as one with fixed
+offsets from an anchor module
+'''
+from util import NamedIDObject, smart_open
+from .analysis import _is_placeable
+
+__all__ = ['Macro', 'read_macros']
+
+class Macro(NamedIDObject):
+    '''
+        offsets : {Module : (dx, dy)}, exactly one module (the anchor) at (0, 0)
+    '''
+    def __init__(self, name, offsets):
+        super().__init__(name)
+        self._offsets = {module : tuple(d) for module, d in offsets.items()}
+
+        anchors = [module for module, d in self._offsets.items() if d == (0, 0)]
+        if len(anchors) != 1:
+            raise ValueError('Macro {} needs exactly one module at offset (0, 0)'.format(name))
+        if len(set(self._offsets.values())) != len(self._offsets):
+            raise ValueError('Macro {} places two modules at the same offset'.format(name))
+        self._anchor = anchors[0]
+
+    @property
+    def anchor(self):
+        return self._anchor
+
+    @property
+    def offsets(self):
+        return self._offsets
+
+    @property
+    def modules(self):
+        return self._offsets.keys()
+
+    @property
+    def extent(self):
+        '''
+            (width, height) in tiles
+        '''
+        dxs = [dx for dx, _ in self._offsets.values()]
+        dys = [dy for _, dy in self._offsets.values()]
+        return max(dxs) - min(dxs) + 1, max(dys) - min(dys) + 1
+
+    def translate(self, p):
+        '''
+            The sites of the modules with the anchor at p
+        '''
+        return {module : (p[0] + dx, p[1] + dy) for module, (dx, dy) in self._offsets.items()}
+
+
+def read_macros(design, file):
+    '''
+        Reads macros from lines of 'macro module dx dy'
+        Returns a list of Macro
+    '''
+    modules = {module.name : module for module in design.modules}
+    groups = dict()
+    seen = set()
+    with smart_open(file) as f:
+        for line in f:
+            line = line.split('#')[0].split()
+            if not line:
+                continue
+            macro, name, dx, dy = line
+            if name not in modules:
+                raise ValueError('Unknown module {} in macro {}'.format(name, macro))
+            module = modules[name]
+            if not _is_placeable(module):
+                raise ValueError('Module {} in macro {} is not placeable'.format(name, macro))
+            if module in seen:
+                raise ValueError('Module {} is in more than one macro'.format(name))
+            seen.add(module)
+            groups.setdefault(macro, dict())[module] = (int(dx), int(dy))
+
+    return [Macro(name, offsets) for name, offsets in groups.items()]
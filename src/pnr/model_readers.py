@@ -1,4 +1,7 @@
 
+from collections import defaultdict
+from .analysis import contracted_nets
+
 #hacky -- this is the same function as defined in pnr.constraints
 def _is_placeable(x) : return x.type_ in ('PE', 'IO')
 
@@ -7,11 +10,18 @@ def place_model_reader(fabric, design, state, vars, solver):
         state[module] = var.get_coordinates()
 
 
-def route_model_reader(fabric, design, p_state, r_state, vars, solver):
-    sources = fabric[16].sources
-    sinks = fabric[16].sinks
+def route_model_reader(fabric, design, p_state, r_state, vars, solver, layer=16):
+    '''
+        Reads the path of every net on its own.  With fanout the paths of
+        the sinks of a driver may configure a shared mux differently, which
+        write_bitstream rejects, so use tree_model_reader for bitstreams
+    '''
+    sources = fabric[layer].sources
+    sinks = fabric[layer].sinks
     
     for net in design.nets:
+        if net.width != layer:
+            continue
         src = net.src
         dst = net.dst
         src_port = net.src_port
@@ -49,9 +59,78 @@ def route_model_reader(fabric, design, p_state, r_state, vars, solver):
         r_state[(net, 'debug')] = path
         for n1, n2 in zip(l, l[1:]):
             edge = graph.getEdge(n1, n2)
-            track = vars[edge]
-            src_port = track.src
-            outname = track.track_names[1]
-            inname = track.track_names[0]
-            state = (src_port.x, src_port.y, track.parent, outname, inname)
-            r_state[net] = state
+            # contracted chains (see fabric.contract_chains) are configured track by track
+            for track in vars[edge].expand():
+                r_state[net] = _track_state(track)
+
+
+def tree_model_reader(fabric, design, p_state, r_state, vars, solver, layer=16):
+    '''
+        route_model_reader which routes all sinks of a driver as one tree:
+        the path to every sink is spliced onto the tree at the last node it
+        shares with it, so shared segments use the same mux settings.
+        Also records the tree (see _record_tree)
+    '''
+    sources = fabric[layer].sources
+    sinks = fabric[layer].sinks
+
+    drivers = defaultdict(list)
+    for src, src_port, dst, dst_port, net in contracted_nets(design):
+        if net.width == layer:
+            drivers[(src, src_port)].append((dst, dst_port, net))
+
+    for (src, src_port), targets in drivers.items():
+        graph = vars[targets[0][2]]
+        root = vars[sources[p_state[src][0] + (src_port,)]]
+        # node -> (parent node, edge)
+        tree = {root : None}
+        paths = []
+        for dst, dst_port, net in targets:
+            node = vars[sinks[p_state[dst][0] + (dst_port,)]]
+            if node not in tree:
+                l = graph.getPath(graph.reaches(root, node))
+                start = max(idx for idx, n in enumerate(l) if n in tree)
+                for n1, n2 in zip(l[start:], l[start + 1:]):
+                    tree[n2] = (n1, graph.getEdge(n1, n2))
+
+            nodes = [node]
+            edges = []
+            while tree[node] is not None:
+                node, edge = tree[node]
+                nodes.append(node)
+                edges.append(edge)
+            nodes.reverse()
+            edges.reverse()
+
+            # record for debug printing
+            r_state[(net, 'debug')] = tuple(graph.names[n] for n in nodes)
+            # contracted chains (see fabric.contract_chains) are configured track by track
+            tracks = [track for edge in edges for track in vars[edge].expand()]
+            for track in tracks:
+                r_state[net] = _track_state(track)
+            paths.append(tracks)
+
+        _record_tree(r_state, [net for _, _, net in targets], paths)
+
+
+def _track_state(track):
+    return (track.src.x, track.src.y, track.parent, track.track_names[1], track.track_names[0])
+
+
+def _record_tree(r_state, nets, paths):
+    '''
+        Records the route tree of a driver with every one of its nets as
+        r_state[(net, 'tree')] : (state, state of the parent track), the
+        parent is None for the tracks leaving the driver
+    '''
+    tree = dict()
+    for tracks in paths:
+        parent = None
+        for track in tracks:
+            state = _track_state(track)
+            tree[state] = parent
+            parent = state
+
+    for net in nets:
+        for state, parent in tree.items():
+            r_state[(net, 'tree')] = (state, parent)
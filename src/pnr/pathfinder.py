@@ -0,0 +1,172 @@
+'''
+PathFinder negotiated congestion router (McMurchie and Ebeling)
+
+An alternative to the MonoSAT encoding for use with PNR.route_with.
+Every wire (fabric port) may carry one driver.  All drivers are routed with
+costs that grow with the present and historical overuse of the wires until
+no wire is shared.
+'''
+from collections import defaultdict
+import heapq
+import numpy as np
+from .analysis import contracted_nets, _routing_layers
+from .model_readers import _track_state, _record_tree
+
+__all__ = ['pathfinder']
+
+class _RoutingGraph:
+    '''
+        Integer indexed graph of the ports and tracks of a fabric layer
+    '''
+    def __init__(self, layer):
+        self.index = dict()
+        self.ports = []
+        self.edges = []
+        for track in layer.tracks:
+            for port in (track.src, track.dst):
+                if port not in self.index:
+                    self.index[port] = len(self.ports)
+                    self.ports.append(port)
+                    self.edges.append([])
+            self.edges[self.index[track.src]].append((self.index[track.dst], track))
+
+        self.xs = np.array([port.x for port in self.ports])
+        self.ys = np.array([port.y for port in self.ports])
+
+    def box(self, nodes, margin):
+        '''
+            Mask of the nodes within the bounding box of nodes grown by margin
+        '''
+        nodes = list(nodes)
+        xs = self.xs[nodes]
+        ys = self.ys[nodes]
+        return ((self.xs >= xs.min() - margin) & (self.xs <= xs.max() + margin)
+                & (self.ys >= ys.min() - margin) & (self.ys <= ys.max() + margin))
+
+
+def _route_tree(graph, source, targets, cost, allowed):
+    '''
+        Routes source to every target one at a time, each search starts
+        from the whole tree built so far (so sinks share wires)
+        Returns {node : (parent, track)} or None if a target is unreachable
+    '''
+    tree = {source : None}
+    for target in sorted(targets):
+        if target in tree:
+            continue
+        dist = {node : 0.0 for node in tree}
+        heap = [(0.0, node) for node in tree]
+        prev = dict()
+        while heap:
+            d, u = heapq.heappop(heap)
+            if u == target:
+                break
+            if d > dist[u]:
+                continue
+            for v, track in graph.edges[u]:
+                if v in tree or not allowed[v]:
+                    continue
+                nd = d + cost[v]
+                if nd < dist.get(v, np.inf):
+                    dist[v] = nd
+                    prev[v] = (u, track)
+                    heapq.heappush(heap, (nd, v))
+        else:
+            return None
+
+        v = target
+        while v not in tree:
+            tree[v] = prev[v]
+            v = prev[v][0]
+    return tree
+
+
+def pathfinder(max_iter=50, margin=1, pres_fac=0.5, pres_mult=1.5, hist_fac=0.2, layers=None):
+    '''
+    pathfinder:
+        router for PNR.route_with
+        margin    : searches are limited to the bounding box of a driver and
+                    its sinks grown by margin (the whole layer if that fails)
+        pres_fac  : initial cost factor of present overuse, multiplied by
+                    pres_mult every iteration
+        hist_fac  : cost added per iteration a wire is overused
+        layers    : bus widths to route, by default every width of the design
+                    (layers share no wires so each one is routed on its own)
+        Writes r_state like tree_model_reader
+    '''
+    def router(fabric, design, p_state, r_state):
+        for layer in _routing_layers(fabric, design, layers):
+            if not _route_layer(fabric, design, p_state, r_state, layer,
+                                max_iter, margin, pres_fac, pres_mult, hist_fac):
+                return False
+        return True
+    return router
+
+
+def _route_layer(fabric, design, p_state, r_state, layer, max_iter, margin, pres_fac, pres_mult, hist_fac):
+    graph = _RoutingGraph(fabric[layer])
+    sources = fabric[layer].sources
+    sinks = fabric[layer].sinks
+
+    # a driver and all of its sinks are routed as one tree
+    drivers = defaultdict(list)
+    for src, src_port, dst, dst_port, net in contracted_nets(design):
+        if net.width != layer:
+            continue
+        s = graph.index[sources[p_state[src][0] + (src_port,)]]
+        t = graph.index[sinks[p_state[dst][0] + (dst_port,)]]
+        drivers[s].append((t, net))
+
+    everywhere = np.ones(len(graph.ports), dtype=bool)
+    boxes = {s : graph.box([s] + [t for t, _ in targets], margin) for s, targets in drivers.items()}
+
+    base = np.ones(len(graph.ports))
+    hist = np.zeros(len(graph.ports))
+    occ = np.zeros(len(graph.ports), dtype=int)
+    trees = dict()
+    factor = pres_fac
+    for _ in range(max_iter):
+        for s, targets in drivers.items():
+            if s in trees:
+                tree = list(trees[s])
+                # only rip up drivers that use an overused wire
+                if not (occ[tree] > 1).any():
+                    continue
+                occ[tree] -= 1
+
+            cost = (base + hist) * (1 + factor * occ)
+            ts = {t for t, _ in targets}
+            tree = _route_tree(graph, s, ts, cost, boxes[s])
+            if tree is None:
+                tree = _route_tree(graph, s, ts, cost, everywhere)
+            if tree is None:
+                return False
+            trees[s] = tree
+            occ[list(tree)] += 1
+
+        over = np.maximum(occ - 1, 0)
+        if not over.any():
+            break
+        hist += hist_fac * over
+        factor *= pres_mult
+    else:
+        return False
+
+    for s, targets in drivers.items():
+        tree = trees[s]
+        paths = []
+        for t, net in targets:
+            tracks = []
+            v = t
+            while tree[v] is not None:
+                v, track = tree[v]
+                # contracted chains (see fabric.contract_chains) are configured track by track
+                tracks.extend(reversed(track.expand()))
+            tracks.reverse()
+            # record for debug printing
+            r_state[(net, 'debug')] = tuple(track.src.name for track in tracks) + (graph.ports[t].name,)
+            for track in tracks:
+                r_state[net] = _track_state(track)
+            paths.append(tracks)
+        _record_tree(r_state, [net for _, net in targets], paths)
+    return True
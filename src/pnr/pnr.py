@@ -1,7 +1,21 @@
-from util import BiMultiDict, BiDict
+from util import BiMultiDict, BiDict, race
 from smt.solvers import Solver_z3, Solver_monosat
+from .model_readers import place_model_reader
+from .constraints import init_positions, distinct, nearest_neighbor, assert_pinned, confine, guarded_reachability, _is_placeable
+from .analysis import contracted_neighbors, contracted_nets, isomorphic_components, _routing_layers
+from .eco import eco_window, _net_key
+from .macros import Macro
+from .route_pool import RoutePool
+from design import Design
+from functools import partial
 import itertools as it
 from smt_switch import solvers
+from smt_switch import functions
+import smt.z3util as zu
+
+And = functions.And()
+Not = functions.Not()
+bvule = functions.bvule()
 
 
 ''' Class for handling place & route '''
@@ -9,6 +23,7 @@ class PNR:
     def __init__(self, fabric, design, solver_str):
         self._fabric = fabric
         self._design = design
+        self._solver_str = solver_str
 
         self._place_state = BiMultiDict()
         self._route_state = BiMultiDict()
@@ -16,11 +31,15 @@ class PNR:
         self._place_vars = BiDict()
         self._route_vars = BiDict()
 
+        self._place_hints = dict()
+        self._route_conflict = []
+
         try:
             self._place_solver = eval('solvers.{}Solver()'.format(solver_str))
         except AttributeError:
             print('{} is not a supported solver'.format(solver_str))
-        self._route_solver = Solver_monosat()
+        # bounds the clauses kept from failed routing attempts
+        self._route_solver = Solver_monosat(max_retired=32)
 
         # set options
         self._place_solver.set_option('produce-models', 'true')
@@ -31,39 +50,480 @@ class PNR:
     def pin_net(self, net, placement):
         pass
 
-    def place_design(self, funcs, model_reader):
+    def hint_module(self, module, placement):
+        '''
+            Suggest a placement for module, used to warm start place_design
+        '''
+        self._place_hints[module] = placement
+
+    def place_design(self, funcs, model_reader, cache=None):
+        '''
+            cache: optional PlacementCache, on a hit the solver is not run
+        '''
+        if cache is not None:
+            key = cache.key(self.fabric, self.design, self._place_state, funcs)
+            # a single lookup, the entry may be corrupt or evicted concurrently
+            try:
+                placement = cache[key]
+            except KeyError:
+                pass
+            else:
+                if placement is None:
+                    return False
+                self._load_placement(placement)
+                return True
+
         constraints = []
         for f in funcs:
             c = f(self.fabric, self.design, self._place_state, self._place_vars, self._place_solver)
             self._place_solver.add(c)
 
         
-        if not self._place_solver.check_sat():
+        sat, pushed = self._check_place()
+        if not sat:
             self._place_solver.reset()
             # set options
             self._place_solver.set_option('produce-models', 'true')
             self._place_vars = BiDict()
+            if cache is not None:
+                cache[key] = None
             return False
         
         model_reader(self.fabric, self.design, self._place_state, self._place_vars, self._place_solver)
 
+        for _ in range(pushed):
+            self._place_solver.pop()
+
+        if cache is not None:
+            cache[key] = {module.name : self._place_state[module][0] for module in self._place_state}
+
         return True
 
+    def _check_place(self):
+        '''
+            check_sat warm started with the placement hints
+            Solvers with phase hints get each hint as a phase.  Otherwise
+            the hints are pushed as soft assumptions (smt_switch has no
+            check_sat_assuming or unsat cores): if they conflict with the
+            constraints they are pushed in chunks, bisecting every chunk
+            that makes the problem unsatisfiable, so only the hints that
+            conflict with the constraints and the hints kept before them
+            are dropped.
+            Returns (sat, number of pushes left for the kept hints)
+        '''
+        solver = self._place_solver
+        hints = [(self._place_vars[module], p) for module, p in self._place_hints.items() if module in self._place_vars]
+        if not hints:
+            return solver.check_sat(), 0
 
-    def route_design(self, funcs, model_reader):
-        constraints = []
+        if hasattr(solver, 'set_phase'):
+            for pos, p in hints:
+                for var, value in pos.hints(p):
+                    solver.set_phase(var, value)
+            return solver.check_sat(), 0
+
+        def push(chunk):
+            solver.push()
+            solver.add(And([var == value for pos, p in chunk for var, value in pos.hints(p)]))
+            if solver.check_sat():
+                return True
+            solver.pop()
+            return False
+
+        if push(hints):
+            return True, 1
+        if not solver.check_sat():
+            return False, 0
+
+        def halves(chunk):
+            # reversed as chunks is a stack
+            return [chunk[len(chunk)//2:], chunk[:len(chunk)//2]]
+
+        pushed = 0
+        chunks = halves(hints)
+        while chunks:
+            chunk = chunks.pop()
+            if push(chunk):
+                pushed += 1
+            elif len(chunk) > 1:
+                chunks += halves(chunk)
+
+        # the model of the last successful check may have been discarded
+        return solver.check_sat(), pushed
+
+    def place_eco(self, placement, changed, funcs, model_reader, radii=(0, 1, 2)):
+        '''
+            Incremental placement after a design change
+            Every module of placement outside the window of radius r around
+            the changed modules (see eco_window) is pinned to its previous
+            site and only the window is solved for.  On failure the next
+            radius is tried and finally the whole design is placed again.
+            funcs must initialize the positions, assert_pinned is added
+        '''
+        for radius in tuple(radii) + (None,):
+            if radius is None:
+                window = set(filter(_is_placeable, self.design.modules))
+            else:
+                window = eco_window(self.design, changed, radius)
+
+            pinned = [module for module in placement if module not in window]
+            for module in pinned:
+                self.pin_module(module, placement[module])
+
+            if self.place_design(tuple(funcs) + (assert_pinned,), model_reader):
+                return True
+
+            for module in pinned:
+                del self._place_state[module]
+
+        return False
+
+    def place_portfolio(self, configs, funcs_fun, timeout=None):
+        '''
+            Races placement configurations in seperate processes
+            configs is an iterable of (solver_str, position_type) and funcs_fun
+            maps a position type (with its solver bound) to constraint generators.
+            Keeps the first placement found and returns the winning config
+            or None if no configuration found a placement
+        '''
+        configs = tuple(configs)
+        jobs = [partial(self._place_job, solver_str, position_type, funcs_fun) for solver_str, position_type in configs]
+        idx, placement = race(jobs, timeout=timeout)
+        if idx is None:
+            return None
+
+        self._load_placement(placement)
+        return configs[idx]
+
+    def place_cubes(self, position_type, funcs_fun, n_modules=2, split='quadrant', timeout=None):
+        '''
+            Cube and conquer placement
+            The n_modules highest degree unpinned modules are each confined
+            to a quadrant (split='quadrant') or a row (split='row') of the
+            fabric, every combination is a cube which is placed in its own
+            process with the constraints of funcs_fun (see place_portfolio).
+            Returns True if a cube was placed, False if every cube was
+            refuted and None if some cube was undecided (timeout or crash)
+        '''
+        neighbors = contracted_neighbors(self.design)
+        free = [module for module in neighbors if module not in self._place_state]
+        modules = sorted(free, key=lambda m : (-len(neighbors[m]), m.name))[:n_modules]
+
+        regions = self._split_sites(split)
+        cubes = [dict(zip(modules, c)) for c in it.product(regions, repeat=len(modules))]
+        jobs = [partial(self._place_job, self._solver_str, position_type, funcs_fun, (confine(cube),)) for cube in cubes]
+        idx, result = race(jobs, timeout=timeout)
+        if idx is not None:
+            self._load_placement(result)
+            return True
+        elif all(r is False for r in result):
+            return False
+        else:
+            return None
+
+    def _split_sites(self, split):
+        if split == 'quadrant':
+            mid_x = self.fabric.cols // 2
+            mid_y = self.fabric.rows // 2
+            regions = [{(x, y) for (x, y) in self.fabric.sites if (x < mid_x) == left and (y < mid_y) == top}
+                       for left in (True, False) for top in (True, False)]
+        elif split == 'row':
+            regions = [{(x, y) for (x, y) in self.fabric.sites if y == row} for row in range(self.fabric.rows)]
+        else:
+            raise ValueError('Unknown split: {}'.format(split))
+        return [r for r in regions if r]
+
+    def _place_job(self, solver_str, position_type, funcs_fun, extra=()):
+        p = PNR(self.fabric, self.design, solver_str)
+        p._place_hints = self._place_hints
+        for module in self._place_state:
+            p.pin_module(module, self._place_state[module][0])
+        funcs = tuple(funcs_fun(partial(position_type, solver=p._place_solver))) + tuple(extra)
+        if not p.place_design(funcs, place_model_reader):
+            return False
+        # modules are returned by name as the objects do not survive the trip
+        return {module.name : p._place_state[module][0] for module in p._place_state}
+
+    def place_diverse(self, funcs, model_reader, k, dist=1, exclude=()):
+        '''
+            Enumerates up to k placements, each differing from all previous
+            ones (and those in exclude) in the site of at least dist modules
+            Modules in the placement state are treated as pinned and the
+            state is left untouched.
+            Returns a list of placements {Module : (x, y)}
+        '''
+        for f in funcs:
+            c = f(self.fabric, self.design, self._place_state, self._place_vars, self._place_solver)
+            self._place_solver.add(c)
+
+        def block(placement):
+            same = [And([var == value for var, value in self._place_vars[module].hints(pos)])
+                    for module, pos in placement.items() if module in self._place_vars]
+            if same:
+                self._place_solver.add(bvule(zu.count(same, self._place_solver), max(len(same) - dist, 0)))
+
+        for placement in exclude:
+            block(placement)
+
+        placements = []
+        while len(placements) < k and self._place_solver.check_sat():
+            state = BiMultiDict()
+            model_reader(self.fabric, self.design, state, self._place_vars, self._place_solver)
+            placement = {module : state[module][0] for module in state}
+            placements.append(placement)
+            block(placement)
+
+        self._place_solver.reset()
+        # set options
+        self._place_solver.set_option('produce-models', 'true')
+        self._place_vars = BiDict()
+        return placements
+
+    def route_placements(self, placements, funcs, model_reader, timeout=None, pool=None, layers=None):
+        '''
+            Routes every placement in its own process and keeps the first
+            one that routes (replacing the current placement)
+            timeout applies to each placement, pool is a RoutePool to share
+            workers with other routing jobs (default: one worker per cpu),
+            layers as for route_all
+            Returns the index of the kept placement or None
+        '''
+        placements = tuple(placements)
+        layers = _routing_layers(self.fabric, self.design, layers)
+        if pool is None:
+            pool = RoutePool()
+        jobs = [pool.submit_route(self, placement, funcs, model_reader, layers, timeout) for placement in placements]
+        try:
+            for job in pool.as_completed(jobs):
+                if job.status == 'done' and job.result:
+                    break
+            else:
+                return None
+        finally:
+            for j in jobs:
+                pool.cancel(j)
+
+        idx = jobs.index(job)
+        self._place_state = BiMultiDict()
+        for module, pos in placements[idx].items():
+            self._place_state[module] = pos
+        self._route_state = BiMultiDict()
+        self._load_route(job.result)
+        return idx
+
+    def _route_job(self, placement, funcs, model_reader, layers=None):
+        # runs in a forked process, so self is a private copy which still
+        # holds any routing graph built before the fork
+        self._place_state = BiMultiDict()
+        for module, pos in placement.items():
+            self._place_state[module] = pos
+        if not self.route_all(funcs, model_reader, layers):
+            return False
+        # nets are returned by key as the objects do not survive the trip
+        route = dict()
+        for net in self._route_state:
+            if isinstance(net, tuple):
+                net, tag = net
+                route[(_net_key(net), tag)] = self._route_state[(net, tag)]
+            else:
+                route[_net_key(net)] = self._route_state[net]
+        return route
+
+    def _load_route(self, route):
+        # merges into the current route state (layers are routed separately)
+        nets = {_net_key(net) : net for net in self.design.nets}
+        for key, states in route.items():
+            if len(key) == 2:
+                net = (nets[key[0]], key[1])
+            else:
+                net = nets[key]
+            for state in states:
+                self._route_state[net] = state
+
+    @property
+    def placement(self):
+        '''
+            The current placement {Module : (x, y)}
+        '''
+        return {module : self._place_state[module][0] for module in self._place_state}
+
+    def place_isomorphic(self, position_type, funcs_fun, max_degree=None, exclude=()):
+        '''
+            Places one instance of every repeated structure (see
+            isomorphic_components) on its own, then makes every instance a
+            macro with that layout so only their anchors are solved for.
+            funcs_fun maps a position type (with its solver bound) and a
+            list of macros to constraint generators (including init_macros).
+            Falls back to placing without the macros.
+        '''
+        macros = []
+        for idx, group in enumerate(isomorphic_components(self.design, max_degree, exclude)):
+            layout = self._place_component(position_type, group[0])
+            if layout is None:
+                continue
+            rep = min(group[0], key=lambda m : m.name)
+            x0, y0 = layout[rep.name]
+            for jdx, mapping in enumerate(group):
+                offsets = {mapping[m] : (layout[m.name][0] - x0, layout[m.name][1] - y0) for m in mapping}
+                macros.append(Macro('iso{}_{}'.format(idx, jdx), offsets))
+
+        position_t = partial(position_type, solver=self._place_solver)
+        if macros and self.place_design(funcs_fun(position_t, macros), place_model_reader):
+            return True
+        return self.place_design(funcs_fun(position_t, ()), place_model_reader)
+
+    def _place_component(self, position_type, modules):
+        names = {m.name for m in modules}
+        mods = {m.name : {'type' : m.type_, 'conf' : m.config} for m in modules}
+        nets = {(src.name, src_port, dst.name, dst_port, net.width)
+                for src, src_port, dst, dst_port, net in contracted_nets(self.design)
+                if src.name in names and dst.name in names and src != dst}
+
+        p = PNR(self.fabric, Design(mods, nets), self._solver_str)
+        position_t = partial(position_type, solver=p._place_solver)
+        if (p.place_design((init_positions(position_t), distinct, nearest_neighbor), place_model_reader)
+                or p.place_design((init_positions(position_t), distinct), place_model_reader)):
+            return {module.name : pos for module, pos in p.placement.items()}
+        return None
+
+    def _load_placement(self, placement):
+        modules = {module.name : module for module in self.design.modules}
+        for name, pos in placement.items():
+            self._place_state[modules[name]] = pos
+
+
+    def route_design(self, funcs, model_reader, layer=16):
+        # everything placement dependent is dropped after the attempt, the
+        # routing graph is kept for the next one (see build_msgraph)
+        self._route_solver.push()
         for f in funcs:
-            # TODO: Layer is currently hardcoded -- eventually iterate through and possibly use different constraints per layer
-            c = f(self.fabric, self.design, self._place_state, self._route_state, self._route_vars, self._route_solver, 16)
+            c = f(self.fabric, self.design, self._place_state, self._route_state, self._route_vars, self._route_solver, layer)
             self._route_solver.add(self._route_solver.And(c))
 
         if not self._route_solver.solve():
+            # nets whose guards (see guarded_reachability) caused the failure
+            self._route_conflict = [self._route_vars.I[lit][0] for lit in self._route_solver.conflict()]
+            self._route_solver.pop()
             return False
-        
-        
-        model_reader(self.fabric, self.design, self._place_state, self._route_state, self._route_vars, self._route_solver)
+
+        model_reader(self.fabric, self.design, self._place_state, self._route_state, self._route_vars, self._route_solver, layer)
+        self._route_solver.pop()
         return True
 
+    def route_all(self, funcs, model_reader, layers=None):
+        '''
+            Routes every layer (bus width) used by the design, or just
+            layers, one after the other in this process
+            Returns False as soon as a layer fails to route
+        '''
+        self._route_state = BiMultiDict()
+        for layer in _routing_layers(self.fabric, self.design, layers):
+            if not self.route_design(funcs, model_reader, layer):
+                return False
+        return True
+
+    def route_bounded(self, funcs_fun, model_reader, margins=(1, 2, 4, None), layers=None):
+        '''
+            Routes with growing routing regions until routing succeeds
+            funcs_fun maps a margin to routing generators (using
+            bounded_msgraph), None stands for the whole fabric
+            Every layer (see route_all) gets its own region
+        '''
+        self._route_state = BiMultiDict()
+        for layer in _routing_layers(self.fabric, self.design, layers):
+            if not any(self.route_design(funcs_fun(margin), model_reader, layer) for margin in margins):
+                return False
+        return True
+
+    def route_layers(self, funcs, model_reader, layers=None, timeout=None, pool=None):
+        '''
+            Routes every layer (bus width) used by the design.  Layers do
+            not share any tracks so each one is routed concurrently in its
+            own process (see route_placements for timeout and pool) and the
+            routes are merged.
+            Returns False if any layer fails to route.
+        '''
+        layers = _routing_layers(self.fabric, self.design, layers)
+        if len(layers) == 1:
+            return self.route_all(funcs, model_reader, layers)
+
+        placement = self.placement
+        if pool is None:
+            pool = RoutePool()
+        jobs = [pool.submit_route(self, placement, funcs, model_reader, (layer,), timeout) for layer in layers]
+        try:
+            for job in pool.as_completed(jobs):
+                # no point in routing the other layers
+                if job.status != 'done' or not job.result:
+                    return False
+        finally:
+            for j in jobs:
+                pool.cancel(j)
+
+        self._route_state = BiMultiDict()
+        for job in jobs:
+            self._load_route(job.result)
+        return True
+
+    def route_with(self, router):
+        '''
+            Routes with a standalone router (e.g. pathfinder) instead of
+            the route solver
+            router :: (fabric, design, p_state, r_state) -> bool
+        '''
+        if router(self.fabric, self.design, self._place_state, self._route_state):
+            return True
+        self._route_state = BiMultiDict()
+        return False
+
+    def place_route_cegar(self, place_funcs, place_model_reader, route_funcs, route_model_reader, max_iter=10, layers=None):
+        '''
+            Closed loop place and route
+            When routing fails the nets in the routing conflict (route_funcs
+            must use guarded_reachability) become a placement lemma
+            forbidding the current sites of their endpoints together, and
+            the placement is solved again incrementally.  Every layer is
+            routed (see route_all).
+            Returns True once a placement routes
+        '''
+        if guarded_reachability not in route_funcs:
+            raise ValueError('place_route_cegar needs guarded_reachability in route_funcs')
+        layers = _routing_layers(self.fabric, self.design, layers)
+        pinned = self.placement
+        if not self.place_design(place_funcs, place_model_reader):
+            return False
+
+        for _ in range(max_iter):
+            if self.route_all(route_funcs, route_model_reader, layers):
+                return True
+
+            # modules of a macro share the position of its anchor
+            anchors = dict()
+            for src, _, dst, _, net in contracted_nets(self.design):
+                if net in self._route_conflict:
+                    for module in (src, dst):
+                        anchors[self._place_vars[module].anchor] = module
+            if not anchors:
+                # the failure does not depend on the placement
+                break
+
+            placement = self.placement
+            self._place_solver.add(Not(And([var == value for module in anchors.values()
+                                            for var, value in self._place_vars[module].hints(placement[module])])))
+
+            self._place_state = BiMultiDict()
+            for module, pos in pinned.items():
+                self._place_state[module] = pos
+            if not self._place_solver.check_sat():
+                break
+            place_model_reader(self.fabric, self.design, self._place_state, self._place_vars, self._place_solver)
+
+        self._place_solver.reset()
+        # set options
+        self._place_solver.set_option('produce-models', 'true')
+        self._place_vars = BiDict()
+        return False
+
     def write_design(self, model_writer):
         model_writer(self._place_state, self._route_state)
 
@@ -0,0 +1,25 @@
+'''
+Process isolated routing
+
+MonoSAT keeps a single global solver per process, so every routing problem
+is solved in a forked process of its own.  The placement and constraint
+generators go in with the fork, routes come back keyed by net (see
+PNR._route_job) and can be loaded with PNR._load_route.
+'''
+from functools import partial
+from util import Pool
+
+__all__ = ['RoutePool']
+
+class RoutePool(Pool):
+    '''
+        Pool of routing jobs, which may be for different placements,
+        layers or designs.  Finished jobs hold the route, or False if the
+        placement is unroutable.
+    '''
+    def submit_route(self, pnr, placement, funcs, model_reader, layers=None, timeout=None):
+        '''
+            Routes placement {Module : (x, y)} of pnr's design on layers
+            (default: every layer of the design, see PNR.route_all)
+        '''
+        return self.submit(partial(pnr._route_job, placement, funcs, model_reader, layers), timeout)
@@ -10,6 +10,9 @@ And = functions.And()
 Or = functions.Or()
 concat = functions.concat()
 
+def _is_range(vals):
+    return len(vals) == max(vals) - min(vals) + 1
+
 
 class PositionBase(NamedIDObject, metaclass=ABCMeta):
     def __init__(self, name, fabric, solver):
@@ -122,6 +125,76 @@ nn
         '''
         pass
 
+    @abstractmethod
+    def translate_x(self, dx):
+        '''
+        translate_x :: int -> z3.BitVec
+
+        x moved by dx, only meaningful if x + dx is on the fabric
+        '''
+        pass
+
+    @abstractmethod
+    def translate_y(self, dy):
+        '''
+        translate_y :: int -> z3.BitVec
+        '''
+        pass
+
+    @property
+    def anchor(self):
+        '''
+        anchor :: -> PositionBase
+
+        the position that owns the variables of self
+        '''
+        return self
+
+    def hints(self, p):
+        '''
+        hints :: (int, int) -> [(z3.BitVec, z3.BitVec)]
+
+        variable, value pairs that put self at p
+        '''
+        return [(self.x, self.encode_x(p[0])), (self.y, self.encode_y(p[1]))]
+
+    def in_x(self, xs):
+        '''
+        in_x :: {int} -> z3.Bool
+        '''
+        return Or([self.x == self.encode_x(x) for x in xs])
+
+    def in_y(self, ys):
+        '''
+        in_y :: {int} -> z3.Bool
+        '''
+        return Or([self.y == self.encode_y(y) for y in ys])
+
+    def restrict(self, sites):
+        '''
+        restrict :: {(int, int)} -> z3.Bool
+
+        constrains self to one of sites
+        '''
+        if not sites:
+            return self.solver.theory_const(sorts.Bool(), False)
+
+        ys_at = dict()
+        for x, y in sites:
+            ys_at.setdefault(x, set()).add(y)
+        ys = set().union(*ys_at.values())
+
+        constraint = []
+        if len(ys_at) < self.fabric.cols:
+            constraint.append(self.in_x(ys_at))
+        if len(ys) < self.fabric.rows:
+            constraint.append(self.in_y(ys))
+        # sites that are not a product of xs and ys
+        for x, ys_x in ys_at.items():
+            if ys_x != ys:
+                constraint.append(Or(self.x != self.encode_x(x), self.in_y(ys_x)))
+        return And(constraint)
+
 class Base2H(PositionBase):
     '''
     Base class for 2 hot representations
@@ -169,6 +242,27 @@ class Base2H(PositionBase):
     def encode_y(self, y):
         return self.solver.theory_const(sorts.BitVec(self.fabric.rows), 2**y)
 
+    def translate_x(self, dx):
+        return self._translate(self.x, dx)
+
+    def translate_y(self, dy):
+        return self._translate(self.y, dy)
+
+    @staticmethod
+    def _translate(bv, d):
+        if d >= 0:
+            return bv << d
+        return functions.bvlshr()(bv, -d)
+
+    def in_x(self, xs):
+        # no bit outside of xs may be hot
+        mask = (2**self.fabric.cols - 1) ^ sum(2**x for x in xs)
+        return self.x & mask == 0
+
+    def in_y(self, ys):
+        mask = (2**self.fabric.rows - 1) ^ sum(2**y for y in ys)
+        return self.y & mask == 0
+
 class Packed2H(Base2H):
     '''
     2 Hot representation, packed into a single BitVec
@@ -181,6 +275,9 @@ class Packed2H(Base2H):
     def flat(self):
         return self._flat
 
+    def hints(self, p):
+        return [(self.flat, self.encode(p))]
+
     @property
     def x(self):
         ext = functions.extract(self.fabric.rows + self.fabric.cols-1, self.fabric.rows)
@@ -299,3 +396,244 @@ class BVXY(PositionBase):
 
     def encode_y(self, y):
         return self.solver.theory_const(sorts.BitVec(self._y_bits), y)
+
+    def translate_x(self, dx):
+        return self.x + dx if dx >= 0 else self.x - (-dx)
+
+    def translate_y(self, dy):
+        return self.y + dy if dy >= 0 else self.y - (-dy)
+
+    def in_x(self, xs):
+        if _is_range(xs):
+            return self._in_range(self.x, self.encode_x(min(xs)), self.encode_x(max(xs)))
+        return super().in_x(xs)
+
+    def in_y(self, ys):
+        if _is_range(ys):
+            return self._in_range(self.y, self.encode_y(min(ys)), self.encode_y(max(ys)))
+        return super().in_y(ys)
+
+    @staticmethod
+    def _in_range(bv, lo, hi):
+        bvule = functions.bvule()
+        return And(bvule(lo, bv), bvule(bv, hi))
+
+
+class OrderXY(PositionBase):
+    '''
+    Order (thermometer) representation, bit i of x is set iff x > i
+    Adjacency and distance reduce to shifts i.e. wiring and small clauses
+    '''
+    def __init__(self, name, fabric, solver):
+        super().__init__(name, fabric, solver)
+        # a single column still needs a bit, invariants pin it to 0
+        self._x_bits = max(self.fabric.cols - 1, 1)
+        self._y_bits = max(self.fabric.rows - 1, 1)
+
+        self._x = solver.declare_const(self.name + '_x', sorts.BitVec(self._x_bits))
+        self._y = solver.declare_const(self.name + '_y', sorts.BitVec(self._y_bits))
+
+    def delta_x(self, other):
+        return self._delta(other, self.fabric.cols, self.delta_x_fun(other), '_delta_x')
+
+    def delta_y(self, other):
+        return self._delta(other, self.fabric.rows, self.delta_y_fun(other), '_delta_y')
+
+    def delta_x_fun(self, other):
+        def delta_fun(constant):
+            return self._abs_shift(self.x, other.x, constant, self._x_bits)
+        return delta_fun
+
+    def delta_y_fun(self, other):
+        def delta_fun(constant):
+            return self._abs_shift(self.y, other.y, constant, self._y_bits)
+        return delta_fun
+
+    @property
+    def flat(self):
+        return concat(self.x, self.y)
+
+    @property
+    def x(self):
+        return self._x
+
+    @property
+    def y(self):
+        return self._y
+
+    @property
+    def invariants(self):
+        constraint = self._ladder(self.x, self._x_bits) + self._ladder(self.y, self._y_bits)
+        if self.fabric.cols == 1:
+            constraint.append(self.x == 0)
+        if self.fabric.rows == 1:
+            constraint.append(self.y == 0)
+        return And(constraint)
+
+    def get_coordinates(self):
+        return (bin(self.solver.get_value(self.x).as_int()).count('1'),
+                bin(self.solver.get_value(self.y).as_int()).count('1'))
+
+    def encode(self, p):
+        return concat(self.encode_x(p[0]), self.encode_y(p[1]))
+
+    def encode_x(self, x):
+        return self.solver.theory_const(sorts.BitVec(self._x_bits), 2**x - 1)
+
+    def encode_y(self, y):
+        return self.solver.theory_const(sorts.BitVec(self._y_bits), 2**y - 1)
+
+    def translate_x(self, dx):
+        return self._translate(self.x, dx)
+
+    def translate_y(self, dy):
+        return self._translate(self.y, dy)
+
+    @staticmethod
+    def _translate(bv, d):
+        if d >= 0:
+            return (bv << d) | (2**d - 1)
+        return functions.bvlshr()(bv, -d)
+
+    def in_x(self, xs):
+        if _is_range(xs):
+            return And(self._ladder_range(self.x, min(xs), max(xs), self.fabric.cols))
+        return super().in_x(xs)
+
+    def in_y(self, ys):
+        if _is_range(ys):
+            return And(self._ladder_range(self.y, min(ys), max(ys), self.fabric.rows))
+        return super().in_y(ys)
+
+    @staticmethod
+    def _ladder_range(bv, lo, hi, size):
+        # lo <= v iff bit lo-1 and v <= hi iff not bit hi
+        constraint = []
+        if lo > 0:
+            constraint.append(functions.extract(lo-1, lo-1)(bv) == 1)
+        if hi < size - 1:
+            constraint.append(functions.extract(hi, hi)(bv) == 0)
+        return constraint
+
+    def _delta(self, other, size, delta_fun, suffix):
+        delta = self.solver.declare_const(self.name+'-'+other.name+suffix, sorts.BitVec(size.bit_length()))
+        constraint = Or([And(delta == c, delta_fun(c)) for c in range(size)])
+        return constraint, delta
+
+    def _abs_shift(self, a, b, constant, bits):
+        if constant == 0:
+            return a == b
+        return Or(self._shift(a, b, constant, bits), self._shift(b, a, constant, bits))
+
+    def _shift(self, a, b, constant, bits):
+        '''
+        _shift :: z3.BitVec -> z3.BitVec -> int -> int -> z3.Bool
+        a == b + constant, b must not lose any set bits when shifted
+        '''
+        if constant > bits:
+            return self.solver.theory_const(sorts.Bool(), False)
+        lshr = functions.bvlshr()
+        return And(a == ((b << constant) | (2**constant - 1)), lshr(b, bits - constant) == 0)
+
+    @staticmethod
+    def _ladder(bv, bits):
+        # bit i+1 => bit i
+        constraint = []
+        for i in range(bits - 1):
+            upper = functions.extract(i+1, i+1)
+            lower = functions.extract(i, i)
+            constraint.append(Or(upper(bv) == 0, lower(bv) == 1))
+        return constraint
+
+
+class Offset(PositionBase):
+    '''
+    A view of an anchor position translated by a constant (dx, dy)
+    Used for the members of a macro, the view has no variables of its own
+    '''
+    def __init__(self, anchor, dx, dy):
+        super().__init__('{}+{}+{}'.format(anchor.name, dx, dy), anchor.fabric, anchor.solver)
+        self._anchor = anchor
+        self._dx = dx
+        self._dy = dy
+
+    def __getattr__(self, attr):
+        # encoding specific helpers (e.g. _abs_shift) come from the anchor
+        if attr == '_anchor':
+            raise AttributeError(attr)
+        return getattr(self._anchor, attr)
+
+    @property
+    def anchor(self):
+        return self._anchor
+
+    @property
+    def offset(self):
+        return self._dx, self._dy
+
+    def delta_x(self, other):
+        return type(self.anchor).delta_x(self, other)
+
+    def delta_y(self, other):
+        return type(self.anchor).delta_y(self, other)
+
+    def delta_x_fun(self, other):
+        return type(self.anchor).delta_x_fun(self, other)
+
+    def delta_y_fun(self, other):
+        return type(self.anchor).delta_y_fun(self, other)
+
+    @property
+    def flat(self):
+        return concat(self.x, self.y)
+
+    @property
+    def x(self):
+        return self.anchor.translate_x(self._dx)
+
+    @property
+    def y(self):
+        return self.anchor.translate_y(self._dy)
+
+    def translate_x(self, dx):
+        return self.anchor.translate_x(self._dx + dx)
+
+    def translate_y(self, dy):
+        return self.anchor.translate_y(self._dy + dy)
+
+    @property
+    def invariants(self):
+        # the anchor must leave room for the offset
+        xs = range(max(0, -self._dx), self.fabric.cols - max(0, self._dx))
+        ys = range(max(0, -self._dy), self.fabric.rows - max(0, self._dy))
+        if not xs or not ys:
+            return self.solver.theory_const(sorts.Bool(), False)
+        return And(self.anchor.in_x(xs), self.anchor.in_y(ys))
+
+    def get_coordinates(self):
+        x, y = self.anchor.get_coordinates()
+        return x + self._dx, y + self._dy
+
+    def encode(self, p):
+        return self.anchor.encode(p)
+
+    def encode_x(self, x):
+        return self.anchor.encode_x(x)
+
+    def encode_y(self, y):
+        return self.anchor.encode_y(y)
+
+    def hints(self, p):
+        return self.anchor.hints((p[0] - self._dx, p[1] - self._dy))
+
+    def in_x(self, xs):
+        xs = {x - self._dx for x in xs if 0 <= x - self._dx < self.fabric.cols}
+        if not xs:
+            return self.solver.theory_const(sorts.Bool(), False)
+        return self.anchor.in_x(xs)
+
+    def in_y(self, ys):
+        ys = {y - self._dy for y in ys if 0 <= y - self._dy < self.fabric.rows}
+        if not ys:
+            return self.solver.theory_const(sorts.Bool(), False)
+        return self.anchor.in_y(ys)
@@ -52,26 +52,176 @@ class Solver_z3(Solver_base):
         else:
             raise RuntimeError('Solver has not been run')
 
+# MonoSAT has a single global solver per process which is owned by the
+# Solver_monosat that initialized it last
+_ms_owner = None
+
 class Solver_monosat(Solver_base):
-    def __init__(self):
+    '''
+        max_retired: MonoSAT can not delete clauses, a popped attempt is
+        only disabled and its clauses stay in the solver.  After this many
+        attempts the next push resets the solver (dropping the graphs too,
+        which are rebuilt by the generators), if nothing outlives the
+        attempts.  None never resets.
+        cache holds what generators keep between attempts (e.g. the
+        routing graphs of build_msgraph) and is cleared by reset.
+    '''
+    def __init__(self, max_retired=None):
+        global _ms_owner
         super().__init__()
         ms.Monosat().init()  # could also use -decide-theories
+        _ms_owner = self
         self.graphs = []
+        self.cache = dict()
+        self.assumptions = []
+        self.stages = []
+        self.stage = None
+        self._asserted = 0
+        self._attempts = []
+        self.objectives = []
+        self._max_retired = max_retired
+        self._retired = 0
 
     def solve(self):
-        ms.Assert(self.And(self.constraints))
-        self.sat = ms.Solve()
+        '''
+            Asserts the constraints added since the last solve and solves
+            under the assumptions.  With stages, each stage literal is
+            assumed in turn until one is satisfiable and its index is
+            recorded in stage.
+        '''
+        c = self.And(self.constraints[self._asserted:])
+        self._asserted = len(self.constraints)
+        if self._attempts:
+            # only holds during the current attempt
+            c = self.Or(~self._attempts[-1][0], c)
+        ms.Assert(c)
+
+        attempts = [lit for lit, _, _, _, _ in self._attempts]
+        if not self.stages:
+            self.sat = self._solve(attempts + self.assumptions)
+            if self.sat:
+                self._minimize(attempts + self.assumptions)
+            return self.sat
+
+        for idx, lit in enumerate(self.stages):
+            self.sat = self._solve(attempts + self.assumptions + [lit])
+            if self.sat:
+                self.stage = idx
+                self._minimize(attempts + self.assumptions + [lit])
+                break
         return self.sat
 
+    def minimize(self, costs):
+        '''
+            Adds objectives [(cost, bound)] which are minimized in order
+            after every satisfiable solve: cost() reads an integer cost from
+            the model and bound(k) is a literal forcing the cost to at most k.
+            Each objective is bisected between 0 and its cost in the model.
+            The bounds found are assumed, not asserted, but every probe
+            creates a literal (e.g. a distance_leq atom of a graph) which
+            stays in MonoSAT until the solver is reset.
+        '''
+        self.objectives.extend(costs)
+
+    def _minimize(self, assumptions):
+        bounds = []
+        for cost, bound in self.objectives:
+            lo, hi = 0, cost()
+            best = None
+            sat = True
+            while lo < hi:
+                mid = (lo + hi) // 2
+                lit = bound(mid)
+                sat = self._solve(assumptions + bounds + [lit])
+                if sat:
+                    best = lit
+                    # the model may be better than the bound
+                    hi = min(cost(), mid)
+                else:
+                    lo = mid + 1
+            if best is not None:
+                bounds.append(best)
+            if not sat:
+                # get back the model of the best bounds
+                self._solve(assumptions + bounds)
+
+    def push(self):
+        '''
+            Starts an attempt: constraints, assumptions, stages and
+            objectives added until the matching pop only hold during the
+            attempt.  Anything asserted directly (graphs, AssertAtMostOne)
+            outlives it and can be reused by later attempts.
+        '''
+        if _ms_owner is not self:
+            # another solver reinitialized MonoSAT
+            self.reset()
+        elif (self._max_retired is not None and self._retired >= self._max_retired
+              and not (self._attempts or self.constraints or self.assumptions or self.stages or self.objectives)):
+            # drop the clauses of the retired attempts
+            self.reset()
+        ms.Assert(self.And(self.constraints[self._asserted:]))
+        self._asserted = len(self.constraints)
+        self._attempts.append((ms.Var(), len(self.constraints), len(self.assumptions), len(self.stages), len(self.objectives)))
+        self.stage = None
+
+    def pop(self):
+        lit, n_constraints, n_assumptions, n_stages, n_objectives = self._attempts.pop()
+        # retire the constraints of the attempt for good, their clauses stay
+        # in MonoSAT until the next reset (see max_retired)
+        ms.Assert(~lit)
+        self._retired += 1
+        del self.constraints[n_constraints:]
+        del self.assumptions[n_assumptions:]
+        del self.stages[n_stages:]
+        del self.objectives[n_objectives:]
+        self._asserted = n_constraints
+
+    def _solve(self, assumptions):
+        if assumptions:
+            return ms.Solve(assumptions)
+        else:
+            return ms.Solve()
+
+    def assume(self, lit):
+        self.assumptions.append(lit)
+
+    def add_stage(self, lit):
+        self.stages.append(lit)
+
+    def conflict(self):
+        '''
+            The assumptions responsible for the last unsat result
+            Empty if the problem is unsat without assumptions
+        '''
+        clause = ms.getConflictClause()
+        if not clause:
+            return []
+        # the conflict clause holds the negated assumptions
+        lits = {l.getLit() for l in clause}
+        return [a for a in self.assumptions if (~a).getLit() in lits]
+
+    def var(self):
+        return ms.Var()
+
     def add_graph(self):
         g = ms.Graph()
         self.graphs.append(g)
         return g
 
     def reset(self):
+        global _ms_owner
         super().reset()
         self.graphs = []
+        self.cache = dict()
+        self.assumptions = []
+        self.stages = []
+        self.stage = None
+        self._asserted = 0
+        self._attempts = []
+        self.objectives = []
+        self._retired = 0
         ms.Monosat().init()
+        _ms_owner = self
 
     def get_model(self):
         if self.sat:
@@ -101,3 +251,12 @@ class Solver_monosat(Solver_base):
 
     def AssertAtMostOne(self, bools):
         return ms.AssertAtMostOne(bools)
+
+    def AtMost(self, bools, k, weights=None):
+        '''
+            Literal implying that the (weighted) number of true bools is at
+            most k, for assuming bounds (see minimize)
+        '''
+        lit = ms.Var()
+        ms.PBManager().conditionalPB(bools, k, '<=', lit, weights)
+        return lit
@@ -2,9 +2,11 @@ import z3
 import operator
 import functools as ft
 from smt_switch import functions
+from smt_switch import sorts
 from util import Mask, build_grouped_mask
 
 And = functions.And()
+Ite = functions.Ite()
 lshr = functions.bvlshr()
 
 
@@ -97,6 +99,18 @@ def absolute_value(bv):
     return mask ^ (bv + mask)
 
 
+def count(bools, solver):
+    '''
+    count :: [z3.Bool] -> z3.BitVec
+
+    number of true bools, wide enough to not overflow
+    '''
+    width = max(len(bools).bit_length(), 1)
+    one = solver.theory_const(sorts.BitVec(width), 1)
+    zero = solver.theory_const(sorts.BitVec(width), 0)
+    return ft.reduce(operator.add, (Ite(b, one, zero) for b in bools))
+
+
 #used in testing
 _GIANT_NUMBER = 5016456510113118655434598811035278955030765345404790744303017523831112055108147451509157692220295382716162651878526895249385292291816524375083746691371804094271873160484737966720260389217684476157468082573 * 14197795064947621068722070641403218320880622795441933960878474914617582723252296732303717722150864096521202355549365628174669108571814760471015076148029755969804077320157692458563003215304957150157403644460363550505412711285966361610267868082893823963790439336411086884584107735010676915
 
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 import sys
+import time
 import design, design.core2graph, fabric, pnr, smt
 from functools import partial
 
@@ -14,8 +15,49 @@ parser.add_argument('--print-place', action='store_true', dest='print_place', he
 parser.add_argument('--print-route', action='store_true', dest='print_route', help='print routing information to stdout')
 parser.add_argument('--bitstream', metavar='<BITSTREAM_FILE>', help='output CGRA configuration in bitstream')
 parser.add_argument('--annotate', metavar='<ANNOTATED_FILE>', help='output bitstream with annotations')
+parser.add_argument('--write-place', metavar='<PLACEMENT_FILE>', dest='write_place', help='output placement for later use with --eco')
+parser.add_argument('--write-route', metavar='<ROUTE_FILE>', dest='write_route', help='output routing for later use with --eco')
+parser.add_argument('--cubes', type=int, metavar='<N_MODULES>', help='cube and conquer placement splitting on the N_MODULES highest degree modules')
+parser.add_argument('--cube-split', choices=('quadrant', 'row'), default='quadrant', dest='cube_split', help='how cubes split the fabric')
+parser.add_argument('--cube-timeout', type=float, dest='cube_timeout', help='give up on cube and conquer after this many seconds')
+parser.add_argument('--diverse', type=int, metavar='<K>', help='if routing fails route K further placements in parallel')
+parser.add_argument('--diverse-dist', type=int, default=1, dest='diverse_dist', help='minimum number of modules in which the placements differ')
+parser.add_argument('--route-timeout', type=float, dest='route_timeout', help='give up on routing a diverse placement (or layer) after this many seconds')
+parser.add_argument('--route-workers', type=int, dest='route_workers', help='number of concurrent routing processes (default: one per cpu)')
+parser.add_argument('--cegar', type=int, metavar='<MAX_ITER>', help='re-place up to MAX_ITER times using the nets that failed to route')
+parser.add_argument('--macros', metavar='<MACRO_FILE>', help='place groups of modules with fixed relative offsets (lines of: macro module dx dy)')
+parser.add_argument('--isomorphic', action='store_true', help='place repeated sub-netlists once and replicate the layout')
+parser.add_argument('--iso-max-degree', type=int, dest='iso_max_degree', help='ignore modules with more neighbours when looking for repeated sub-netlists')
+parser.add_argument('--floorplan', metavar='<FLOORPLAN_FILE>', help='constrain groups of modules to regions of the fabric')
+parser.add_argument('--co-design', nargs='+', metavar='<DESIGN_FILE>', dest='co_design', help='place and route further designs on the same fabric (module names get a d<index>_ prefix)')
+parser.add_argument('--co-compact', nargs=2, type=int, metavar=('<WIDTH>', '<HEIGHT>'), dest='co_compact', help='keep each design within a WIDTH x HEIGHT window')
+parser.add_argument('--contract-chains', action='store_true', dest='contract_chains', help='contract routing graph chains (e.g. feedthroughs) into single tracks')
+parser.add_argument('--min-wirelength', action='store_true', dest='min_wirelength', help='minimize the total number of tracks used and report the wirelength')
+parser.add_argument('--min-net-wirelength', action='store_true', dest='min_net_wirelength', help='minimize the tracks on the path of every net, one net at a time, and report the wirelength')
+parser.add_argument('--router', choices=('monosat', 'pathfinder'), default='monosat', help='router to use (--cegar, --diverse and --eco routes need monosat)')
+parser.add_argument('--pathfinder-iter', type=int, default=50, dest='pathfinder_iter', help='maximum number of pathfinder iterations')
+parser.add_argument('--pathfinder-margin', type=int, default=1, dest='pathfinder_margin', help='grow the search box of each net by this many tiles')
+parser.add_argument('--route-margin', type=int, dest='route_margin', help='only route within this many tiles of the nets, growing the region on failure')
+parser.add_argument('--dist-schedule', nargs='+', type=lambda f : None if f == 'none' else int(f), metavar='<FACTOR>', dest='dist_schedule',
+                    help='escalating routing distance factors tried in order (none for unbounded) instead of 1')
+parser.add_argument('--excl', choices=('pairwise', 'amo'), default='pairwise', help='routing exclusivity encoding')
+parser.add_argument('--congestion', type=float, metavar='<FACTOR>', help='limit nets covering a tile to FACTOR times its track count during placement')
+parser.add_argument('--place-cache', metavar='<CACHE_DIR>', dest='place_cache', help='reuse placements of identical design, fabric and constraints')
+parser.add_argument('--place-cache-size', type=int, dest='place_cache_size', help='maximum number of cached placements')
+parser.add_argument('--place-cache-age', type=float, dest='place_cache_age', help='evict cached placements unused for this many seconds')
+parser.add_argument('--hints', metavar='<PLACEMENT_FILE>', help='warm start placement from a previous or heuristic placement')
+parser.add_argument('--eco', nargs='+', metavar='<FILE>', help='incremental run: <OLD_DESIGN_FILE> <PLACEMENT_FILE> [<ROUTE_FILE>]')
+parser.add_argument('--eco-radii', nargs='+', type=int, dest='eco_radii', default=[0, 1, 2], help='netlist distances around changed modules to re-place')
 parser.add_argument('--solver', help='choose the smt solver to use for placement', default='Z3')
+parser.add_argument('--position', help='choose the position encoding to use for placement', default='BVXY')
+parser.add_argument('--portfolio', nargs='+', metavar='<SOLVER:POSITION>', help='race placement configurations in parallel')
+parser.add_argument('--portfolio-timeout', type=float, dest='portfolio_timeout', help='give up on a portfolio after this many seconds')
+parser.add_argument('--portfolio-log', metavar='<LOG_FILE>', dest='portfolio_log', help='append the winning portfolio configuration to a file')
 args = parser.parse_args()
+if args.eco and len(args.eco) not in (2, 3):
+    parser.error('--eco expects <OLD_DESIGN_FILE> <PLACEMENT_FILE> [<ROUTE_FILE>]')
+if args.eco and args.co_design:
+    parser.error('--eco can not be combined with --co-design')
 
 design_file = args.design
 fabric_file = args.fabric
@@ -24,39 +66,256 @@ print("Loading design: {}".format(design_file))
 modules, nets = design.core2graph.load_core(design_file, *args.libs)
 des = design.Design(modules, nets)
 
+if args.co_design:
+    designs = [des]
+    for co_file in args.co_design:
+        print("Loading design: {}".format(co_file))
+        co_modules, co_nets = design.core2graph.load_core(co_file, *args.libs)
+        designs.append(design.Design(co_modules, co_nets))
+    des, design_parts = design.merge_designs(designs)
+
 print("Loading fabric: {}".format(fabric_file))
 fab = fabric.parse_xml(fabric_file)
+if args.contract_chains:
+    fab.contract_chains()
 
 p = pnr.PNR(fab, des, args.solver)
 
-POSITION_T = partial(smt.BVXY, solver=p._place_solver)
-PLACE_CONSTRAINTS = pnr.init_positions(POSITION_T), pnr.distinct, pnr.nearest_neighbor, pnr.pin_IO
-PLACE_RELAXED =  pnr.init_positions(POSITION_T), pnr.distinct, pnr.pin_IO
-ROUTE_CONSTRAINTS = pnr.build_msgraph, pnr.excl_constraints, pnr.reachability, pnr.dist_limit(1)
+if args.congestion is not None:
+    PLACE_EXTRA = pnr.congestion(args.congestion),
+else:
+    PLACE_EXTRA = ()
+
+# symmetry breaking has to know about the restrictions
+SYMMETRY = dict()
+if args.co_design and args.co_compact:
+    PLACE_EXTRA += pnr.compact(design_parts, *args.co_compact),
+    SYMMETRY.update(groups=design_parts, window=args.co_compact)
+
+if args.floorplan:
+    print("Loading floorplan: {}".format(args.floorplan))
+    FLOORPLAN = pnr.read_floorplan(des, fab, args.floorplan)
+    PLACE_EXTRA += pnr.confine(FLOORPLAN),
+    SYMMETRY.update(sites=FLOORPLAN)
+
+if args.macros:
+    print("Loading macros: {}".format(args.macros))
+    MACROS = pnr.read_macros(des, args.macros)
+else:
+    MACROS = []
+
+def place_constraints(position_t, macros=()):
+    return (pnr.init_macros(position_t, MACROS + list(macros)), pnr.init_positions(position_t), pnr.prune_domains(1, io=True),
+            pnr.distinct, pnr.nearest_neighbor, pnr.pin_IO, pnr.break_symmetries(**SYMMETRY)) + PLACE_EXTRA
+
+def place_relaxed(position_t, macros=()):
+    return (pnr.init_macros(position_t, MACROS + list(macros)), pnr.init_positions(position_t), pnr.prune_domains(io=True),
+            pnr.distinct, pnr.pin_IO) + PLACE_EXTRA
+
+if args.hints:
+    print("Loading placement hints: {}".format(args.hints))
+    for module, placement in pnr.read_placement(des, args.hints).items():
+        p.hint_module(module, placement)
+
+if args.place_cache:
+    cache = pnr.PlacementCache(args.place_cache, args.place_cache_size, args.place_cache_age)
+else:
+    cache = None
+
+POSITION_T = partial(getattr(smt, args.position), solver=p._place_solver)
+PLACE_CONSTRAINTS = place_constraints(POSITION_T)
+PLACE_RELAXED = place_relaxed(POSITION_T)
+if args.dist_schedule:
+    DIST_LIMIT = pnr.dist_schedule(args.dist_schedule)
+else:
+    DIST_LIMIT = pnr.dist_limit(1)
+
+if args.excl == 'amo':
+    EXCL = pnr.excl_amo
+else:
+    EXCL = pnr.excl_constraints
+
+if args.min_wirelength:
+    ROUTE_EXTRA = pnr.min_wirelength,
+elif args.min_net_wirelength:
+    ROUTE_EXTRA = pnr.min_net_wirelength,
+else:
+    ROUTE_EXTRA = ()
+
+ROUTE_CONSTRAINTS = (pnr.build_msgraph, EXCL, pnr.reachability, DIST_LIMIT) + ROUTE_EXTRA
+
+def route_constraints(margin):
+    return (pnr.bounded_msgraph(margin), EXCL, pnr.reachability, DIST_LIMIT) + ROUTE_EXTRA
+
+if args.route_margin is not None:
+    ROUTE_MARGINS = args.route_margin, 2*args.route_margin + 1, 4*args.route_margin + 3, None
+else:
+    ROUTE_MARGINS = None,
+
+# guarded reachability reports the nets that fail to route
+ROUTE_CEGAR = (pnr.build_msgraph, EXCL, pnr.guarded_reachability, DIST_LIMIT) + ROUTE_EXTRA
+
+ROUTE_POOL = pnr.RoutePool(args.route_workers) if args.route_workers else None
+
+# the sinks of a driver share their tracks, write_bitstream rejects
+# independently read paths that disagree on a mux
+ROUTE_READER = pnr.tree_model_reader
 # To use multigraph encoding:
 # Note: This encoding does not handle fanout for now
 # Once nets represent the whole tree of connections, this will be fixed
 # ROUTE_CONSTRAINTS = pnr.build_net_graphs, pnr.reachability, pnr.dist_limit(1)
 
 
-print("Placing design...", end=' ')
-if p.place_design(PLACE_CONSTRAINTS, pnr.place_model_reader):
-    print("success!")
+def log_winner(config, relaxed, elapsed):
+    solver_str, position_type = config
+    print("{}:{} won in {:.2f}s".format(solver_str, position_type.__name__, elapsed))
+    if args.portfolio_log:
+        with open(args.portfolio_log, 'a') as f:
+            f.write('{} {} {} {} {} {:.3f}\n'.format(design_file, fabric_file, solver_str,
+                                                   position_type.__name__, 'relaxed' if relaxed else 'nearest_neighbor', elapsed))
+
+if args.eco:
+    print("Loading previous design: {}".format(args.eco[0]))
+    old_modules, old_nets = design.core2graph.load_core(args.eco[0], *args.libs)
+    changed = pnr.design_diff(design.Design(old_modules, old_nets), des)
+    eco_placement = pnr.read_placement(des, args.eco[1])
+    print("{} modules changed".format(len(changed)))
+
+    print("Placing design incrementally...", end=' ')
+    if p.place_eco(eco_placement, changed, PLACE_CONSTRAINTS, pnr.place_model_reader, args.eco_radii):
+        print("success!")
+    else:
+        print("\nfailed with nearest_neighbor, relaxing...", end = ' ')
+        if p.place_eco(eco_placement, changed, PLACE_RELAXED, pnr.place_model_reader, args.eco_radii):
+            print("success!")
+        else:
+            print("!!!failure!!!")
+            sys.exit(1)
+elif args.cegar:
+    print("Placing and routing design...", end=' ')
+    if p.place_route_cegar(PLACE_CONSTRAINTS, pnr.place_model_reader, ROUTE_CEGAR, ROUTE_READER, args.cegar):
+        print("success!")
+    else:
+        print("\nfailed with nearest_neighbor, relaxing...", end = ' ')
+        if p.place_route_cegar(PLACE_RELAXED, pnr.place_model_reader, ROUTE_CEGAR, ROUTE_READER, args.cegar):
+            print("success!")
+        else:
+            print("!!!failure!!!")
+            sys.exit(1)
+elif args.isomorphic:
+    print("Placing design with replicated structures...", end=' ')
+    position_type = getattr(smt, args.position)
+    in_macros = {module for macro in MACROS for module in macro.modules}
+    if p.place_isomorphic(position_type, place_constraints, args.iso_max_degree, in_macros):
+        print("success!")
+    else:
+        print("\nfailed with nearest_neighbor, relaxing...", end = ' ')
+        if p.place_isomorphic(position_type, place_relaxed, args.iso_max_degree, in_macros):
+            print("success!")
+        else:
+            print("!!!failure!!!")
+            sys.exit(1)
+elif args.cubes:
+    print("Placing design with {} cubes...".format(args.cube_split), end=' ')
+    position_type = getattr(smt, args.position)
+    result = p.place_cubes(position_type, place_constraints, args.cubes, args.cube_split, args.cube_timeout)
+    if result:
+        print("success!")
+    else:
+        print("\nfailed with nearest_neighbor ({}), relaxing...".format('unsat' if result is False else 'unknown'), end = ' ')
+        if p.place_cubes(position_type, place_relaxed, args.cubes, args.cube_split, args.cube_timeout):
+            print("success!")
+        else:
+            print("!!!failure!!!")
+            sys.exit(1)
+elif args.portfolio:
+    configs = []
+    for config in args.portfolio:
+        solver_str, position = config.split(':')
+        configs.append((solver_str, getattr(smt, position)))
+
+    print("Placing design with portfolio...", end=' ')
+    start = time.time()
+    winner = p.place_portfolio(configs, place_constraints, args.portfolio_timeout)
+    if winner is not None:
+        print("success!")
+        log_winner(winner, False, time.time() - start)
+    else:
+        print("\nfailed with nearest_neighbor, relaxing...", end = ' ')
+        start = time.time()
+        winner = p.place_portfolio(configs, place_relaxed, args.portfolio_timeout)
+        if winner is not None:
+            print("success!")
+            log_winner(winner, True, time.time() - start)
+        else:
+            print("!!!failure!!!")
+            sys.exit(1)
 else:
-    print("\nfailed with nearest_neighbor, relaxing...", end = ' ')
-    if p.place_design(PLACE_RELAXED, pnr.place_model_reader):
+    print("Placing design...", end=' ')
+    if p.place_design(PLACE_CONSTRAINTS, pnr.place_model_reader, cache):
         print("success!")
     else:
-        print("!!!failure!!!")
-        sys.exit(1)
+        print("\nfailed with nearest_neighbor, relaxing...", end = ' ')
+        if p.place_design(PLACE_RELAXED, pnr.place_model_reader, cache):
+            print("success!")
+        else:
+            print("!!!failure!!!")
+            sys.exit(1)
 
 print("Routing design...", end=' ')
-if p.route_design(ROUTE_CONSTRAINTS, pnr.route_model_reader):
-    print("success!")
+if args.cegar:
+    print("done with placement")
+elif args.router == 'pathfinder':
+    if p.route_with(pnr.pathfinder(args.pathfinder_iter, args.pathfinder_margin)):
+        print("success!")
+    else:
+        print("!!!failure!!!")
+        sys.exit(1)
+elif args.eco and len(args.eco) == 3:
+    eco_routes = pnr.read_route(des, args.eco[2])
+    if p.route_all(ROUTE_CONSTRAINTS + (pnr.pin_routes(eco_routes, eco_placement),), ROUTE_READER):
+        print("success!")
+    elif p.route_all(ROUTE_CONSTRAINTS, ROUTE_READER):
+        print("success! (previous routes dropped)")
+    else:
+        print("!!!failure!!!")
+        sys.exit(1)
+elif len({net.width for net in des.nets}) > 1:
+    # 1-bit and 16-bit nets are routed concurrently on their own layers
+    if p.route_layers(ROUTE_CONSTRAINTS, ROUTE_READER, timeout=args.route_timeout, pool=ROUTE_POOL):
+        print("success!")
+    else:
+        print("!!!failure!!!")
+        sys.exit(1)
+elif p.route_bounded(route_constraints, ROUTE_READER, ROUTE_MARGINS):
+    if args.dist_schedule:
+        print("success! (distance factor {})".format(args.dist_schedule[p._route_solver.stage]))
+    else:
+        print("success!")
+elif args.diverse:
+    print("\nenumerating {} placements...".format(args.diverse), end=' ')
+    q = pnr.PNR(fab, des, args.solver)
+    position_t = partial(getattr(smt, args.position), solver=q._place_solver)
+    placements = q.place_diverse(place_constraints(position_t), pnr.place_model_reader,
+                                 args.diverse, args.diverse_dist, [p.placement])
+    if len(placements) < args.diverse:
+        placements += q.place_diverse(place_relaxed(position_t), pnr.place_model_reader,
+                                      args.diverse - len(placements), args.diverse_dist, [p.placement] + placements)
+    print("routing {} placements...".format(len(placements)), end=' ')
+    idx = p.route_placements(placements, ROUTE_CONSTRAINTS, ROUTE_READER, args.route_timeout, ROUTE_POOL)
+    if idx is not None:
+        print("success! (placement {})".format(idx))
+    else:
+        print("!!!failure!!!")
+        sys.exit(1)
 else:
     print("!!!failure!!!")
     sys.exit(1)
 
+if args.min_wirelength or args.min_net_wirelength:
+    print("Wirelength (tracks):")
+    p.write_design(pnr.write_wirelength(des))
+
 if args.bitstream:
     bit_file = args.bitstream
     print("Writing bitsream to: {}".format(bit_file))
@@ -69,6 +328,14 @@ if args.annotate:
 
     
 
+if args.write_place:
+    print("Writing placement to: {}".format(args.write_place))
+    p.write_design(pnr.write_placement(args.write_place))
+
+if args.write_route:
+    print("Writing routing to: {}".format(args.write_route))
+    p.write_design(pnr.write_route(args.write_route))
+
 if args.print or args.print_place:
     print("\nPlacement info:")
     p.write_design(pnr.write_debug(des))
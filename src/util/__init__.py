@@ -2,3 +2,4 @@ from .classutil import *
 from .dictutil import *
 from .mask import *
 from .smart_handler import *
+from .parallel import *
@@ -78,6 +78,11 @@ class BiDict(MutableMapping):
         return self._d[key]
 
     def __setitem__(self, key, val):
+        if key in self._d:
+            # drop the inverse of the replaced value
+            old = self._d[key]
+            if old in self._i and self._i[old] == key:
+                del self._i[old]
         self._d[key] = val
         self._i[val] = key
 
@@ -0,0 +1,171 @@
+import multiprocessing as mp
+from multiprocessing.connection import wait as _wait
+import os
+import time
+import traceback
+
+__all__ = ['race', 'Job', 'Pool']
+
+# closures (constraint generators, position types bound to solvers) can not
+# be pickled so workers must be forked
+_ctx = mp.get_context('fork')
+_poll_interval = 0.1
+
+def _worker(fun, conn):
+    try:
+        result = True, fun()
+    except Exception:
+        traceback.print_exc()
+        result = False, None
+    conn.send(result)
+    conn.close()
+
+
+class Job:
+    '''
+        A function run in its own process by a Pool
+        status is one of pending, running, done, failed (raised or crashed),
+        timeout or cancelled.  result is only set for done jobs.
+    '''
+    def __init__(self, fun, timeout):
+        self._fun = fun
+        self._timeout = timeout
+        self._proc = None
+        self._conn = None
+        self._deadline = None
+        self.status = 'pending'
+        self.result = None
+
+    @property
+    def finished(self):
+        return self.status not in ('pending', 'running')
+
+
+class Pool:
+    '''
+        Runs jobs in forked processes, at most max_workers at a time
+        (default: one per cpu).  Every process only ever runs one job, so
+        global solver state (e.g. MonoSAT) is never shared between jobs,
+        and a job that times out or is cancelled is simply terminated.
+    '''
+    def __init__(self, max_workers=None):
+        self._max_workers = max_workers or os.cpu_count() or 1
+        self._pending = []
+        self._running = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+
+    def submit(self, fun, timeout=None):
+        '''
+            Schedules fun, timeout (seconds) counts from when the job starts
+        '''
+        job = Job(fun, timeout)
+        self._pending.append(job)
+        self._schedule()
+        return job
+
+    def cancel(self, job):
+        if job.status == 'pending':
+            self._pending.remove(job)
+        elif job.status == 'running':
+            self._stop(job)
+        else:
+            return
+        job.status = 'cancelled'
+        self._schedule()
+
+    def shutdown(self):
+        ''' Cancels every unfinished job '''
+        for job in self._pending + self._running:
+            self.cancel(job)
+
+    def as_completed(self, jobs, timeout=None):
+        '''
+            Yields jobs as they finish (in any state)
+            With a timeout, stops yielding after that many seconds leaving
+            the remaining jobs untouched
+        '''
+        jobs = list(jobs)
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+
+        while jobs:
+            for job in [job for job in jobs if job.finished]:
+                jobs.remove(job)
+                yield job
+            if not jobs:
+                return
+
+            if timeout is not None and time.monotonic() > deadline:
+                return
+
+            self._check_timeouts()
+            ready = _wait([job._conn for job in self._running], _poll_interval)
+            for job in [job for job in self._running if job._conn in ready]:
+                try:
+                    ok, result = job._conn.recv()
+                except EOFError:
+                    # died without reporting back
+                    ok, result = False, None
+                self._stop(job)
+                job.status = 'done' if ok else 'failed'
+                job.result = result
+            self._schedule()
+
+    def wait(self, jobs, timeout=None):
+        '''
+            Waits for jobs to finish, returns the finished ones
+        '''
+        return list(self.as_completed(jobs, timeout))
+
+    def _schedule(self):
+        while self._pending and len(self._running) < self._max_workers:
+            job = self._pending.pop(0)
+            recv, send = _ctx.Pipe(duplex=False)
+            job._proc = _ctx.Process(target=_worker, args=(job._fun, send), daemon=True)
+            job._proc.start()
+            # only the worker writes
+            send.close()
+            job._conn = recv
+            if job._timeout is not None:
+                job._deadline = time.monotonic() + job._timeout
+            job.status = 'running'
+            self._running.append(job)
+
+    def _check_timeouts(self):
+        now = time.monotonic()
+        for job in list(self._running):
+            if job._deadline is not None and now > job._deadline and not job._conn.poll():
+                self._stop(job)
+                job.status = 'timeout'
+
+    def _stop(self, job):
+        self._running.remove(job)
+        job._proc.terminate()
+        job._proc.join()
+        job._conn.close()
+
+
+def race(funs, accept=bool, timeout=None):
+    '''
+    race :: [() -> a] -> (a -> bool) -> float -> (int, a)
+
+    Runs each function in its own process, at most one per cpu at a time
+    (the rest are queued).  Returns the index and result of the first
+    result for which accept is true, terminating the remaining processes.
+    If no result is accepted returns (None, results) where results[i] is
+    the result of funs[i] or None if it did not finish (raised, crashed,
+    timed out or never started).
+    '''
+    with Pool() as pool:
+        jobs = [pool.submit(fun) for fun in funs]
+        for job in pool.as_completed(jobs, timeout):
+            if job.status == 'done' and accept(job.result):
+                return jobs.index(job), job.result
+
+    return None, [job.result for job in jobs]
+
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+'''
+    Benchmark the exclusivity encodings of the MonoSAT router
+
+    Each design is placed once (relaxed) on the fabric and then routed with
+    build_msgraph, reachability and dist_limit plus either excl_constraints
+    or excl_amo.  Constraint build time and solve time are reported
+    separately.  Designs come from test/examples (skipped if they do not fit
+    the fabric) or are random DAGs of PEs (--random).
+'''
+import argparse
+import glob
+import os
+import random
+import sys
+import time
+from functools import partial
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from design.design import Design
+from util import BiDict, BiMultiDict
+import fabric
+import pnr
+import smt
+
+from bench_position import load_dot
+
+ENCODINGS = {
+    'pairwise' : pnr.excl_constraints,
+    'amo'      : pnr.excl_amo,
+}
+
+def random_design(n, seed):
+    rng = random.Random(seed)
+    modules = {'p{}'.format(i) : {'type' : 'PE', 'conf' : 'add'} for i in range(n)}
+    nets = []
+    for i in range(1, n):
+        for port in rng.sample(('a', 'b'), rng.randint(1, 2)):
+            nets.append(('p{}'.format(rng.randrange(i)), 'out', 'p{}'.format(i), port, 16))
+    return Design(modules, nets, 'random_{}_{}'.format(n, seed))
+
+
+def place(fab, des, solver_str):
+    p = pnr.PNR(fab, des, solver_str)
+    position_t = partial(smt.BVXY, solver=p._place_solver)
+    if not p.place_design((pnr.init_positions(position_t), pnr.distinct), pnr.place_model_reader):
+        return None
+    return p
+
+
+def route(p, excl, dist_factor):
+    solver = p._route_solver
+    solver.reset()
+    p._route_vars = BiDict()
+    p._route_state = BiMultiDict()
+
+    funcs = pnr.build_msgraph, excl, pnr.reachability, pnr.dist_limit(dist_factor)
+    start = time.time()
+    for f in funcs:
+        c = f(p.fabric, p.design, p._place_state, p._route_state, p._route_vars, solver, 16)
+        solver.add(solver.And(c))
+    built = time.time()
+    sat = solver.solve()
+    return sat, built - start, time.time() - built
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark routing exclusivity encodings')
+    parser.add_argument('fabric', metavar='<FABRIC_FILE>', help='XML Fabric file')
+    parser.add_argument('examples', nargs='*', metavar='<DOT_FILE>', help='graphs to route (default test/examples/*.dot)')
+    parser.add_argument('--random', nargs='+', type=int, default=(), metavar='<SIZE>', help='also route random designs of these sizes')
+    parser.add_argument('--seeds', type=int, default=3, help='random designs per size')
+    parser.add_argument('--solver', default='Z3', help='smt solver used for placement')
+    parser.add_argument('--dist-factor', type=int, default=2, dest='dist_factor', help='dist_limit factor')
+    args = parser.parse_args()
+
+    fab = fabric.parse_xml(args.fabric)
+    n_sites = sum(1 for kind in fab.sites.values() if kind == 'PE')
+
+    examples = args.examples
+    if not examples and not args.random:
+        examples = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'examples', '*.dot')))
+
+    designs = [load_dot(file_name) for file_name in examples]
+    designs += [random_design(n, seed) for n in args.random for seed in range(args.seeds)]
+
+    print('{:<40} {:>7} {:>5} {:<9} {:>9} {:>9} {:<6}'.format('design', 'modules', 'nets', 'encoding', 'build', 'solve', 'result'))
+    for des in designs:
+        if len(des.modules) > n_sites:
+            print('{:<40} does not fit the fabric'.format(des.name))
+            continue
+        p = place(fab, des, args.solver)
+        if p is None:
+            print('{:<40} could not be placed'.format(des.name))
+            continue
+        for name, excl in ENCODINGS.items():
+            sat, build, solve = route(p, excl, args.dist_factor)
+            print('{:<40} {:>7} {:>5} {:<9} {:>8.2f}s {:>8.2f}s {:<6}'.format(
+                des.name, len(des.modules), len(des.nets), name, build, solve, 'sat' if sat else 'unsat'))
+
+
+if __name__ == '__main__':
+    main()
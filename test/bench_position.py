@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+'''
+    Benchmark the position encodings on the graphs in test/examples
+
+    Every node is treated as a PE and placed on the smallest square grid that
+    fits the graph (plus --margin).  Both the nearest_neighbor problem (often
+    unsat, so this measures the proof) and the relaxed problem are timed.
+'''
+import argparse
+import glob
+import math
+import os
+import sys
+import time
+from collections import namedtuple
+from functools import partial
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from design.design import Design
+from util import dot2smt, race
+import pnr
+import smt
+
+# positions only need the grid dimensions
+Grid = namedtuple('Grid', ('rows', 'cols'))
+
+PORTS = 'a', 'b', 'c', 'd'
+
+def load_dot(file_name):
+    adj = dot2smt.from_file(file_name)
+    modules = {name : {'type' : 'PE', 'conf' : 'add'} for name in adj}
+    nets = []
+    n_inputs = dict.fromkeys(adj, 0)
+    for src, dsts in adj.items():
+        for dst, _ in dsts:
+            k = n_inputs[dst]
+            n_inputs[dst] += 1
+            port = PORTS[k] if k < len(PORTS) else 'in{}'.format(k)
+            nets.append((src, 'out', dst, port, 16))
+    return Design(modules, nets, os.path.basename(file_name))
+
+
+def run(des, grid, solver_str, position_type, relaxed):
+    p = pnr.PNR(grid, des, solver_str)
+    position_t = partial(position_type, solver=p._place_solver)
+    funcs = [pnr.init_positions(position_t), pnr.distinct]
+    if not relaxed:
+        funcs.append(pnr.nearest_neighbor)
+
+    start = time.time()
+    sat = p.place_design(funcs, pnr.place_model_reader)
+    return sat, time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark position encodings')
+    parser.add_argument('examples', nargs='*', metavar='<DOT_FILE>', help='graphs to place (default test/examples/*.dot)')
+    parser.add_argument('--solvers', nargs='+', default=['Z3'], help='smt solvers to run')
+    parser.add_argument('--positions', nargs='+', default=['BVXY', 'Packed2H', 'Unpacked2H', 'OrderXY'], help='position encodings to compare')
+    parser.add_argument('--margin', type=int, default=1, help='extra rows and cols on top of the smallest grid')
+    parser.add_argument('--timeout', type=float, default=300, help='seconds per run')
+    args = parser.parse_args()
+
+    examples = args.examples
+    if not examples:
+        examples = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'examples', '*.dot')))
+
+    print('{:<40} {:>6} {:<10} {:<12} {:<8} {:>10} {}'.format('example', 'grid', 'solver', 'position', 'problem', 'time', 'result'))
+    for file_name in examples:
+        des = load_dot(file_name)
+        side = math.ceil(math.sqrt(len(des.modules))) + args.margin
+        grid = Grid(side, side)
+        for relaxed in (False, True):
+            for solver_str in args.solvers:
+                for position in args.positions:
+                    job = partial(run, des, grid, solver_str, getattr(smt, position), relaxed)
+                    idx, result = race([job], accept=lambda r: r is not None, timeout=args.timeout)
+                    if idx is None:
+                        elapsed, res = '-', 'timeout'
+                    else:
+                        sat, elapsed = result
+                        elapsed, res = '{:.2f}s'.format(elapsed), 'sat' if sat else 'unsat'
+                    print('{:<40} {:>6} {:<10} {:<12} {:<8} {:>10} {}'.format(
+                        os.path.basename(file_name), '{}x{}'.format(side, side), solver_str, position,
+                        'relaxed' if relaxed else 'nn', elapsed, res))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+'''
+Placement tests, run from src with: python -m pytest ../test
+'''
+import os
+from functools import partial
+import pytest
+from design.design import Design
+from util import BiMultiDict
+import fabric
+import pnr
+import smt
+
+CGRA4X4 = os.path.join(os.path.dirname(__file__), '..', 'cgra4x4.xml')
+
+# i0 -> p0 -> p1 -> p2 -> o0
+CHAIN = Design(dict([(name, {'type' : 'PE', 'conf' : 'add'}) for name in ('p0', 'p1', 'p2')] +
+                    [(name, {'type' : 'IO', 'conf' : 'i'}) for name in ('i0', 'o0')]),
+               [('i0', 'out', 'p0', 'a', 16), ('p0', 'out', 'p1', 'a', 16),
+                ('p1', 'out', 'p2', 'b', 16), ('p2', 'out', 'o0', 'a', 16)])
+CHAIN_MODULES = {m.name : m for m in CHAIN.modules}
+
+
+def place(p, funcs):
+    position_t = partial(smt.BVXY, solver=p._place_solver)
+    funcs = (pnr.init_positions(position_t), pnr.distinct, pnr.nearest_neighbor) + tuple(funcs)
+    if not p.place_design(funcs, pnr.place_model_reader):
+        return None
+    return {module.name : site for module, site in p.placement.items()}
+
+
+def test_domains_io_and_pinned():
+    fab = fabric.parse_xml(CGRA4X4)
+    i0, p0 = CHAIN_MODULES['i0'], CHAIN_MODULES['p0']
+    domains = pnr.placement_domains(fab, CHAIN, dict())
+    assert domains[i0] > pnr.io_sites(fab)
+    assert domains[p0] == set(fab.sites)
+    domains = pnr.placement_domains(fab, CHAIN, dict(), io=True)
+    assert domains[i0] == pnr.io_sites(fab)
+
+    state = {i0 : [(0, 0)]}
+    domains = pnr.placement_domains(fab, CHAIN, state, dist=1)
+    assert domains[i0] == {(0, 0)}
+    assert domains[p0] == {(1, 0), (0, 1)}
+
+
+def test_prune_domains_keeps_placement():
+    placement = {'i0' : (0, 0), 'p0' : (1, 0), 'p1' : (1, 1), 'p2' : (1, 2), 'o0' : (0, 2)}
+    domains = pnr.placement_domains(fabric.parse_xml(CGRA4X4), CHAIN, dict(), dist=1, io=True)
+    assert all(placement[m.name] in sites for m, sites in domains.items())
+
+    p = pnr.PNR(fabric.parse_xml(CGRA4X4), CHAIN, 'Z3')
+    sites = {CHAIN_MODULES[name] : {site} for name, site in placement.items()}
+    assert place(p, (pnr.prune_domains(1, io=True), pnr.pin_IO, pnr.confine(sites))) == placement
+
+    # IO modules may go anywhere without pin_IO
+    sites = {CHAIN_MODULES['i0'] : {(1, 1)}}
+    assert place(pnr.PNR(fabric.parse_xml(CGRA4X4), CHAIN, 'Z3'), (pnr.prune_domains(1), pnr.confine(sites)))
+
+
+def test_macro_wider_than_fabric():
+    des = Design({name : {'type' : 'PE', 'conf' : 'add'} for name in ('p0', 'p1')},
+                 [('p0', 'out', 'p1', 'a', 16)])
+    modules = {m.name : m for m in des.modules}
+    macro = pnr.Macro('wide', {modules['p0'] : (0, 0), modules['p1'] : (4, 0)})
+    assert macro.extent == (5, 1)
+
+    p = pnr.PNR(fabric.parse_xml(CGRA4X4), des, 'Z3')
+    position_t = partial(smt.BVXY, solver=p._place_solver)
+    with pytest.raises(ValueError, match='wide'):
+        p.place_design((pnr.init_macros(position_t, [macro]), pnr.init_positions(position_t), pnr.distinct),
+                       pnr.place_model_reader)
+
+    # an offset view that can not fit is unsatisfiable rather than an error
+    anchor = position_t('p0', p.fabric)
+    p._place_solver.add(smt.Offset(anchor, 4, 0).invariants)
+    assert not p._place_solver.check_sat()
+
+
+def test_automorphisms_preserve_ports():
+    fab = fabric.parse_xml(CGRA4X4)
+    assert len(pnr.fabric_automorphisms(fab, io=False)) == 7
+    # a tile without a b input only maps to itself
+    del fab[16].sinks[(3, 3, 'b')]
+    automorphisms = pnr.fabric_automorphisms(fab, io=False)
+    assert len(automorphisms) == 1
+    assert all(sigma[(3, 3)] == (3, 3) for sigma in automorphisms)
+
+
+def test_interchangeable_ports():
+    des = Design({name : {'type' : 'PE', 'conf' : 'add'} for name in ('p0', 'p1', 'p2', 'p3')},
+                 [('p0', 'out', 'p1', 'a', 16), ('p0', 'out', 'p2', 'a', 16), ('p0', 'out', 'p3', 'b', 16)])
+    groups = [sorted(m.name for m in group) for group in pnr.interchangeable_modules(des)]
+    assert groups == [['p1', 'p2']]
+
+    domains = {m : {(0, 0)} for m in des.modules}
+    domains[next(m for m in des.modules if m.name == 'p2')] = {(1, 1)}
+    assert pnr.interchangeable_modules(des, domains=domains) == []
+
+
+def test_cache_entries(tmp_path):
+    cache = pnr.PlacementCache(str(tmp_path), max_entries=2)
+    cache['k0'] = {'p0' : (1, 2)}
+    cache['k1'] = None
+    assert cache['k0'] == {'p0' : (1, 2)}
+    assert cache['k1'] is None
+    with pytest.raises(KeyError):
+        cache['missing']
+
+    # oldest first
+    os.utime(cache._file('k0'), (0, 0))
+    cache['k2'] = {}
+    assert 'k0' not in cache and 'k1' in cache and 'k2' in cache
+
+
+def test_cache_corrupt_entry(tmp_path):
+    fab = fabric.parse_xml(CGRA4X4)
+    cache = pnr.PlacementCache(str(tmp_path))
+    p = pnr.PNR(fab, CHAIN, 'Z3')
+    funcs = (pnr.init_positions(partial(smt.BVXY, solver=p._place_solver)), pnr.distinct, pnr.nearest_neighbor)
+    key = cache.key(fab, CHAIN, p._place_state, funcs)
+    with open(cache._file(key), 'w') as f:
+        f.write('{"p0" : [0,')
+    with pytest.raises(KeyError):
+        cache[key]
+
+    assert p.place_design(funcs, pnr.place_model_reader, cache)
+    assert set(cache[key]) == set(CHAIN_MODULES)
+
+
+def test_hints_conflicting():
+    des = Design({name : {'type' : 'PE', 'conf' : 'add'} for name in ('p0', 'p1', 'p2', 'p3')},
+                 [('p0', 'out', 'p1', 'a', 16), ('p1', 'out', 'p2', 'a', 16), ('p2', 'out', 'p3', 'a', 16)])
+    p = pnr.PNR(fabric.parse_xml(CGRA4X4), des, 'Z3')
+    hints = {'p0' : (0, 0), 'p1' : (1, 0), 'p2' : (3, 3), 'p3' : (2, 1)}
+    for module in des.modules:
+        p.hint_module(module, hints[module.name])
+    placement = place(p, ())
+    # only the hint for p2 can not be kept
+    assert placement['p0'] == (0, 0) and placement['p1'] == (1, 0) and placement['p3'] == (2, 1)
+
+
+def test_symmetries_confined_row():
+    des = Design({name : {'type' : 'PE', 'conf' : 'add'} for name in ('p0', 'p1', 'p2')},
+                 [('p0', 'out', 'p1', 'a', 16), ('p1', 'out', 'p2', 'a', 16)])
+    fab = fabric.parse_xml(CGRA4X4)
+    row = {(x, 3) for x in range(fab.cols)}
+    sites = {m : row for m in des.modules}
+    for position_type in (smt.BVXY, smt.OrderXY):
+        p = pnr.PNR(fab, des, 'Z3')
+        position_t = partial(position_type, solver=p._place_solver)
+        assert p.place_design((pnr.init_positions(position_t), pnr.distinct, pnr.nearest_neighbor,
+                               pnr.confine(sites), pnr.break_symmetries(sites)), pnr.place_model_reader)
+        assert all(site in row for site in p.placement.values())
+
+
+def test_symmetries_confined_sinks():
+    des = Design({name : {'type' : 'PE', 'conf' : 'add'} for name in ('p0', 'p1', 'p2')},
+                 [('p0', 'out', 'p1', 'a', 16), ('p0', 'out', 'p2', 'a', 16)])
+    modules = {m.name : m for m in des.modules}
+    sites = {modules['p1'] : {(3, 3)}, modules['p2'] : {(1, 3)}}
+    placement = place(pnr.PNR(fabric.parse_xml(CGRA4X4), des, 'Z3'), (pnr.confine(sites), pnr.break_symmetries(sites)))
+    assert placement['p1'] == (3, 3) and placement['p2'] == (1, 3)
+
+
+def test_read_floorplan(tmp_path):
+    fab = fabric.parse_xml(CGRA4X4)
+    file = tmp_path / 'floorplan.txt'
+    file.write_text('region top rows 0 1 # comment\n'
+                    'region left rect 0 0 1 3\n'
+                    'region few sites 0,0 1,1 9,9\n'
+                    'group top p*\n'
+                    'group left p1 p2\n'
+                    'group few p2\n')
+    sites = {m.name : s for m, s in pnr.read_floorplan(CHAIN, fab, str(file)).items()}
+    assert set(sites) == {'p0', 'p1', 'p2'}
+    assert sites['p0'] == {(x, y) for x in range(4) for y in range(2)}
+    assert sites['p1'] == {(x, y) for x in range(2) for y in range(2)}
+    assert sites['p2'] == {(0, 0), (1, 1)}
+
+    for text in ('group top p0\n', 'region top rows 0 1\ngroup top q*\n', 'region r circle 1\n'):
+        file.write_text(text)
+        with pytest.raises(ValueError):
+            pnr.read_floorplan(CHAIN, fab, str(file))
+
+
+def test_isomorphic_components():
+    nets = [('s', 'out', 'a0', 'a'), ('a0', 'out', 'b0', 'a'),
+            ('s', 'out', 'a1', 'a'), ('a1', 'out', 'b1', 'a'),
+            ('s', 'out', 'a2', 'a'), ('a2', 'out', 'b2', 'b')]
+    des = Design({name : {'type' : 'PE', 'conf' : 'add'} for name in ('s', 'a0', 'b0', 'a1', 'b1', 'a2', 'b2')},
+                 [net + (16,) for net in nets])
+    groups = pnr.isomorphic_components(des, max_degree=2)
+    assert len(groups) == 1
+    mappings = [{m.name : n.name for m, n in mapping.items()} for mapping in groups[0]]
+    assert mappings == [{'a0' : 'a0', 'b0' : 'b0'}, {'a0' : 'a1', 'b0' : 'b1'}]
+
+    # the shared driver joins everything into one component
+    assert pnr.isomorphic_components(des) == []
+    s = next(m for m in des.modules if m.name == 's')
+    assert len(pnr.isomorphic_components(des, exclude={s})[0]) == 2
+
+
+def test_eco_diff_and_window():
+    modules = {'p0' : {'type' : 'PE', 'conf' : 'add'}, 'p1' : {'type' : 'PE', 'conf' : 'mul'},
+               'p2' : {'type' : 'PE', 'conf' : 'add'}, 'p3' : {'type' : 'PE', 'conf' : 'add'},
+               'i0' : {'type' : 'IO', 'conf' : 'i'}, 'o0' : {'type' : 'IO', 'conf' : 'i'},
+               'c0' : {'type' : 'Const', 'conf' : 1}}
+    nets = [('i0', 'out', 'p0', 'a'), ('p0', 'out', 'p1', 'a'), ('p1', 'out', 'p2', 'b'),
+            ('p2', 'out', 'o0', 'a'), ('p2', 'out', 'p3', 'a'), ('c0', 'out', 'p3', 'b')]
+    new = Design(modules, [net + (16,) for net in nets])
+    names = lambda ms : {m.name for m in ms}
+    assert names(pnr.design_diff(CHAIN, new)) == {'p1', 'p2', 'p3', 'c0'}
+    assert names(pnr.design_diff(new, new)) == set()
+
+    new_modules = {m.name : m for m in new.modules}
+    p1 = new_modules['p1']
+    assert names(pnr.eco_window(new, {p1}, 0)) == {'p1'}
+    assert names(pnr.eco_window(new, {p1}, 1)) == {'p0', 'p1', 'p2'}
+    assert names(pnr.eco_window(new, {p1}, 2)) == {'i0', 'p0', 'p1', 'p2', 'p3', 'o0'}
+    # an unplaceable module marks the modules it is connected to
+    assert names(pnr.eco_window(new, {new_modules['c0']}, 0)) == {'p3'}
+
+
+def test_eco_read_back(tmp_path):
+    p_state = BiMultiDict()
+    p_state[CHAIN_MODULES['p0']] = (1, 2)
+    p_state[CHAIN_MODULES['i0']] = (0, 2)
+    net = next(net for net in CHAIN.nets if net.src.name == 'p0')
+    r_state = BiMultiDict()
+    r_state[net] = (1, 2, 'sb', 'out_0_BUS16_S0_T0', 'pe_out_res')
+    r_state[net] = (1, 3, 'cb', 'a', 'in_BUS16_S3_T0')
+    r_state[(net, 'debug')] = ('ignored',)
+
+    file = str(tmp_path / 'eco.txt')
+    pnr.write_placement(file)(p_state, r_state)
+    with open(file, 'a') as f:
+        f.write('removed 3 3\n')
+    placement = pnr.read_placement(CHAIN, file)
+    assert {m.name : site for m, site in placement.items()} == {'p0' : (1, 2), 'i0' : (0, 2)}
+
+    pnr.write_route(file)(p_state, r_state)
+    assert dict(pnr.read_route(CHAIN, file)) == {net : list(r_state[net])}
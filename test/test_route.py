@@ -0,0 +1,169 @@
+'''
+Routing tests, run from src with: python -m pytest ../test
+'''
+import os
+from collections import defaultdict
+from functools import partial
+import pytest
+import design.core2graph
+from design.design import Design
+import fabric
+import pnr
+import smt
+
+CGRA4X4 = os.path.join(os.path.dirname(__file__), '..', 'cgra4x4.xml')
+
+# p0 -> p1 -> p2 on both layers
+MIXED = Design({name : {'type' : 'PE', 'conf' : 'add'} for name in ('p0', 'p1', 'p2')},
+               [('p0', 'out', 'p1', 'a', 16), ('p1', 'out', 'p2', 'a', 16),
+                ('p0', 'out', 'p1', 'd', 1), ('p1', 'out', 'p2', 'd', 1)])
+
+# i0 -> p0 -> p1, p2 -> o0 with p1 -> p2, pinned to a column
+FANOUT = Design(dict([(name, {'type' : 'PE', 'conf' : 'add'}) for name in ('p0', 'p1', 'p2')] +
+                     [(name, {'type' : 'IO', 'conf' : 'i'}) for name in ('i0', 'o0')]),
+                [('i0', 'out', 'p0', 'a', 16), ('p0', 'out', 'p1', 'a', 16), ('p0', 'out', 'p2', 'a', 16),
+                 ('p1', 'out', 'p2', 'b', 16), ('p2', 'out', 'o0', 'a', 16)])
+FANOUT_PLACEMENT = {'i0' : (0, 0), 'p0' : (1, 0), 'p1' : (1, 1), 'p2' : (1, 2), 'o0' : (0, 2)}
+
+ROUTE_CONSTRAINTS = (pnr.build_msgraph, pnr.excl_constraints, pnr.guarded_reachability)
+
+
+def place(p):
+    position_t = partial(smt.BVXY, solver=p._place_solver)
+    return p.place_design((pnr.init_positions(position_t), pnr.distinct, pnr.nearest_neighbor),
+                          pnr.place_model_reader)
+
+
+def test_io_bit_input():
+    assert design.core2graph._translate_port('IO', ['in'], 16) == 'a'
+    assert design.core2graph._translate_port('IO', ['in'], 1) == 'd'
+    assert design.core2graph._translate_port('PE', ['bit', 'out'], 1) == 'out'
+
+
+def test_pathfinder_mixed_widths():
+    p = pnr.PNR(fabric.parse_xml(CGRA4X4), MIXED, 'Z3')
+    assert place(p)
+    assert p.route_with(pnr.pathfinder())
+    assert all(p._route_state[net] for net in MIXED.nets)
+
+    with pytest.raises(ValueError):
+        p.route_with(pnr.pathfinder(layers=(8,)))
+
+
+def test_route_all_mixed_widths():
+    p = pnr.PNR(fabric.parse_xml(CGRA4X4), MIXED, 'Z3')
+    assert place(p)
+    assert p.route_all(ROUTE_CONSTRAINTS, pnr.tree_model_reader)
+    assert all(p._route_state[net] for net in MIXED.nets)
+
+
+def test_cegar_mixed_widths():
+    p = pnr.PNR(fabric.parse_xml(CGRA4X4), MIXED, 'Z3')
+    position_t = partial(smt.BVXY, solver=p._place_solver)
+    assert p.place_route_cegar((pnr.init_positions(position_t), pnr.distinct, pnr.nearest_neighbor),
+                               pnr.place_model_reader, ROUTE_CONSTRAINTS, pnr.tree_model_reader)
+    assert all(p._route_state[net] for net in MIXED.nets)
+
+
+def test_cegar_needs_conflicts():
+    p = pnr.PNR(fabric.parse_xml(CGRA4X4), MIXED, 'Z3')
+    position_t = partial(smt.BVXY, solver=p._place_solver)
+    with pytest.raises(ValueError):
+        p.place_route_cegar((pnr.init_positions(position_t), pnr.distinct), pnr.place_model_reader,
+                            (pnr.build_msgraph, pnr.excl_constraints, pnr.reachability), pnr.tree_model_reader)
+
+
+def test_min_wirelength():
+    p = pnr.PNR(fabric.parse_xml(CGRA4X4), MIXED, 'Z3')
+    assert place(p)
+    def total():
+        return len({state for net in MIXED.nets for state in p._route_state[net]})
+
+    # pathfinder routes every net on a shortest path here
+    assert p.route_with(pnr.pathfinder())
+    shortest = total()
+    assert p.route_all(ROUTE_CONSTRAINTS + (pnr.min_wirelength,), pnr.tree_model_reader)
+    assert total() <= shortest
+
+
+def test_layer_graphs_replaced():
+    p = pnr.PNR(fabric.parse_xml(CGRA4X4), MIXED, 'Z3')
+    assert place(p)
+    funcs = lambda margin : (pnr.bounded_msgraph(margin), pnr.excl_amo, pnr.guarded_reachability)
+    assert p.route_design(funcs(0), pnr.tree_model_reader)
+    n = len(p._route_vars)
+    # only the current graph of the layer is kept in vars
+    assert p.route_design(funcs(None), pnr.tree_model_reader)
+    assert p.route_design(funcs(0), pnr.tree_model_reader)
+    assert len(p._route_vars) == n
+
+
+def test_pathfinder_routes():
+    p = pnr.PNR(fabric.parse_xml(CGRA4X4), FANOUT, 'Z3')
+    for module in FANOUT.modules:
+        p.pin_module(module, FANOUT_PLACEMENT[module.name])
+    assert p.route_with(pnr.pathfinder())
+
+    r_state = p._route_state
+    drivers = defaultdict(set)
+    for net in FANOUT.nets:
+        assert r_state[net]
+        drivers[net.src] |= set(r_state[net])
+    # no track is used by two drivers
+    for d1 in drivers:
+        for d2 in drivers:
+            assert d1 == d2 or not drivers[d1] & drivers[d2]
+    # the sinks of p0 share its tree
+    net = next(net for net in FANOUT.nets if net.src.name == 'p0')
+    assert len(r_state[(net, 'tree')]) == len(drivers[net.src])
+
+
+def _pe_reachability(layer):
+    # PE output -> PE inputs reachable through the tracks
+    succ = defaultdict(set)
+    for track in layer.tracks:
+        succ[track.src].add(track.dst)
+    outs = {port for (x, y, name), port in layer.sources.items() if name == 'out'}
+    ins = {port for (x, y, name), port in layer.sinks.items() if name in ('a', 'b', 'd')}
+    reach = dict()
+    for out in outs:
+        seen = {out}
+        frontier = [out]
+        while frontier:
+            for n in succ[frontier.pop()]:
+                if n not in seen:
+                    seen.add(n)
+                    frontier.append(n)
+        reach[out] = seen & ins
+    return reach
+
+
+def test_contract_chains_reachability():
+    for name in ('cgra2x2.xml', 'cgra4x4.xml'):
+        fab = fabric.parse_xml(os.path.join(os.path.dirname(__file__), '..', name))
+        for bus_width in (1, 16):
+            layer = fab[bus_width]
+            contracted = fabric.contract_chains(layer)
+            assert len(contracted.tracks) < len(layer.tracks)
+            assert _pe_reachability(contracted) == _pe_reachability(layer)
+            # chains expand to connected tracks of the original layer
+            tracks = set(layer.tracks)
+            for track in contracted.tracks:
+                chain = track.expand()
+                assert set(chain) <= tracks
+                assert all(t1.dst == t2.src for t1, t2 in zip(chain, chain[1:]))
+                assert chain[0].src == track.src and chain[-1].dst == track.dst
+
+
+def test_contract_chains_route_states():
+    contracted = fabric.parse_xml(CGRA4X4)
+    contracted.contract_chains()
+    p = pnr.PNR(contracted, FANOUT, 'Z3')
+    for module in FANOUT.modules:
+        p.pin_module(module, FANOUT_PLACEMENT[module.name])
+    assert p.route_with(pnr.pathfinder())
+    # routes are written in terms of the original tracks
+    tracks = fabric.parse_xml(CGRA4X4)[16].tracks
+    states = {(t.src.x, t.src.y, t.parent, t.track_names[1], t.track_names[0]) for t in tracks}
+    for net in FANOUT.nets:
+        assert p._route_state[net] and set(p._route_state[net]) <= states
@@ -0,0 +1,43 @@
+'''
+Utility tests, run from src with: python -m pytest ../test
+'''
+import os
+import time
+from functools import partial
+from util import BiDict, Pool, race
+
+
+def test_bidict_replace():
+    d = BiDict()
+    d['a'] = 1
+    d['a'] = 2
+    assert dict(d.I) == {2 : 'a'}
+    d['b'] = 2
+    d['a'] = 3
+    assert dict(d.I) == {2 : 'b', 3 : 'a'}
+
+
+def _raise():
+    raise ValueError()
+
+
+def test_race_queues():
+    n = 2*(os.cpu_count() or 1) + 1
+    funs = [partial(pow, i, 2) for i in range(n)]
+    assert race(funs, accept=lambda r : r == (n - 1)**2) == (n - 1, (n - 1)**2)
+    idx, results = race(funs, accept=lambda r : False)
+    assert idx is None and results == [i**2 for i in range(n)]
+    assert race([_raise], timeout=5) == (None, [None])
+
+
+def test_pool_max_workers():
+    with Pool(2) as pool:
+        jobs = [pool.submit(partial(pow, i, 2)) for i in range(5)]
+        assert len([job for job in jobs if job.status == 'running']) == 2
+        assert len(pool.wait(jobs)) == 5
+        assert all(job.status == 'done' for job in jobs)
+        assert [job.result for job in jobs] == [i**2 for i in range(5)]
+
+        job = pool.submit(partial(time.sleep, 10), timeout=0.2)
+        pool.wait([job])
+        assert job.status == 'timeout'